@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+
+# Summaries across benchmark strategy result directories, for comparing runs
+# at different host and fork counts.
+#
+#   ./bench_report.py phases results.h100.f50 results.h1000.f50 results.h10000.f50
+#   ./bench_report.py runs results.h1000.f50 results.h1000.f50.free results.h1000.f50.host_pinned
+#   ./bench_report.py compare results.h1000.f50 results.h1000.f50.gcfreeze
+#   ./bench_report.py tasks results.h1000.f50 results.h1000.f50.inline
+#   ./bench_report.py connection results.h1000.f50 results.h1000.f50.pipelining
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from collections import OrderedDict
+
+
+PHASES = ['iterator', 'vars', 'templating', 'queue', 'results', 'callbacks', 'other']
+
+
+def load_runs(bdir, suffix):
+    ''' run id -> contents of every <run>_<suffix> file in a results dir, oldest run first '''
+    runs = OrderedDict()
+    for fn in sorted(glob.glob(os.path.join(bdir, '*_%s' % suffix))):
+        with open(fn, 'r') as f:
+            runs[os.path.basename(fn)[:-len(suffix) - 1]] = json.loads(f.read())
+    return runs
+
+
+def report_runs(args):
+
+    cols = ['strategy', 'hosts', 'forks', 'wall', 'dispatched', 'tasks/s', 'ms/task']
+    print(' '.join(['%-12s' % x for x in cols]))
+    rows = []
+    for bdir in args.dirs:
+        for meta in load_runs(bdir, 'meta.json').values():
+            if not meta.get('stop') or meta['stop'] - meta['start'] < args.min_wall:
+                continue
+            rows.append(meta)
+    for meta in sorted(rows, key=lambda x: (x['hosts'], x['forks'], x.get('strategy') or 'linear')):
+        wall = meta['stop'] - meta['start']
+        dispatched = meta.get('dispatched')
+        line = [
+            (meta.get('strategy') or 'linear') + (' dry' if meta.get('dry_run') else ''),
+            meta['hosts'],
+            meta['forks'],
+            '%.2f' % wall,
+            '-' if dispatched is None else dispatched,
+            '-' if dispatched is None else '%.1f' % (dispatched / wall),
+            '-' if not dispatched else '%.3f' % (wall / dispatched * 1000),
+        ]
+        print(' '.join(['%-12s' % x for x in line]))
+
+
+def report_phases(args):
+
+    rows = []
+    for bdir in args.dirs:
+        for phases in load_runs(bdir, 'phases.json').values():
+            # skip the tiny plays, like the localhost one in run_scale_strategy.yml
+            if not phases['tasks'] or phases['wall'] < args.min_wall:
+                continue
+            rows.append((bdir, phases))
+    rows = sorted(rows, key=lambda x: (x[1]['hosts'], x[1]['forks']))
+
+    cols = ['strategy', 'hosts', 'forks', 'wall'] + PHASES
+    print(' '.join(['%-10s' % x for x in cols]))
+    for bdir, phases in rows:
+        line = [
+            '%-10s' % (phases.get('strategy') or 'linear'),
+            '%-10s' % phases['hosts'],
+            '%-10s' % phases['forks'],
+            '%-10.2f' % phases['wall']
+        ]
+        for phase in PHASES:
+            seconds = phases['phases'].get(phase, {}).get('seconds', 0.0)
+            line.append('%-10s' % ('%.1f/%d%%' % (seconds, seconds / phases['wall'] * 100)))
+        print(' '.join(line))
+
+        if args.tasks:
+            for task in phases['tasks']:
+                line = ['%-32s' % (task['task_name'] or task['task_uuid'])[:32]]
+                for phase in PHASES:
+                    tphase = task['phases'].get(phase)
+                    if tphase is None:
+                        line.append('%-10s' % '-')
+                        continue
+                    # cumulative seconds and p99 of a single call
+                    line.append('%-10s' % ('%.2f/%.4f' % (tphase['seconds'], tphase['calls']['p99'])))
+                print('    ' + ' '.join(line))
+
+
+def report_dispatch(args):
+
+    cols = ['strategy', 'hosts', 'forks', 'wall', 'dispatch p50/p99', 'idle p50/p99', 'depth mean/max']
+    print(' '.join(['%-18s' % x for x in cols]))
+    for bdir in args.dirs:
+        metas = load_runs(bdir, 'meta.json')
+        hists = load_runs(bdir, 'histograms.json')
+        for run_id, meta in metas.items():
+            if run_id not in hists or not meta.get('stop') or meta['stop'] - meta['start'] < args.min_wall:
+                continue
+            hist = hists[run_id]
+            run = hist['run']
+            line = [
+                meta.get('strategy') or 'linear',
+                meta['hosts'],
+                meta['forks'],
+                '%.2f' % (meta['stop'] - meta['start']),
+                '%s/%s' % (fmt_seconds(run['dispatch_latency']['p50']), fmt_seconds(run['dispatch_latency']['p99'])),
+                '%s/%s' % (fmt_seconds(run['worker_idle']['p50']), fmt_seconds(run['worker_idle']['p99'])),
+                '%.1f/%s' % (run['queue_depth']['mean'] or 0, run['queue_depth']['max']),
+            ]
+            print(' '.join(['%-18s' % x for x in line]))
+
+
+def load_workers(fn):
+    ''' worker records from a <run>_workers.ndjson, as dicts keyed by its header fields '''
+    workers = []
+    with open(fn, 'r') as f:
+        fields = json.loads(f.readline())['fields']
+        for line in f:
+            if line.strip():
+                workers.append(dict(zip(fields, json.loads(line))))
+    return workers
+
+
+def percentile(values, pct):
+    values = sorted(x for x in values if x is not None)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def mean(values):
+    values = [x for x in values if x is not None]
+    if not values:
+        return None
+    return sum(values) / len(values)
+
+
+def report_workers(args):
+
+    cols = ['workers', 'fork p50/p99', 'child start p50', 'rss@fork', 'minflt', 'majflt', 'cpu', 'pss', 'dirty']
+    for bdir in args.dirs:
+        metas = load_runs(bdir, 'meta.json')
+        hists = load_runs(bdir, 'histograms.json')
+        for run_id, meta in metas.items():
+            fn = os.path.join(bdir, '%s_workers.ndjson' % run_id)
+            if not os.path.exists(fn) or not meta.get('stop') or meta['stop'] - meta['start'] < args.min_wall:
+                continue
+            by_task = OrderedDict()
+            for worker in load_workers(fn):
+                by_task.setdefault(worker['task_uuid'], []).append(worker)
+            tasks = dict((x['task_uuid'], x) for x in hists.get(run_id, {}).get('tasks', []))
+
+            print('%s %s hosts:%s forks:%s' % (bdir, meta.get('strategy') or 'linear', meta['hosts'], meta['forks']))
+            print('    %-24s %s' % ('task', ' '.join(['%-16s' % x for x in cols])))
+            for task_uuid, workers in by_task.items():
+                hist = tasks.get(task_uuid, {})
+                fork_cost = hist.get('fork_cost', {})
+                cpu = [(x['utime'] or 0) + (x['stime'] or 0) if x.get('utime') is not None else None for x in workers]
+                line = [
+                    len(workers),
+                    '%s/%s' % (fmt_seconds(fork_cost.get('p50')), fmt_seconds(fork_cost.get('p99'))),
+                    fmt_seconds(percentile([x['start'] - x['fork'] for x in workers if x.get('fork')], 50)),
+                    fmt_bytes(mean([x.get('rss_at_fork') for x in workers])),
+                    fmt_number(mean([x.get('minflt') for x in workers])),
+                    fmt_number(mean([x.get('majflt') for x in workers])),
+                    fmt_seconds(mean(cpu)),
+                    fmt_bytes(mean([x.get('pss') for x in workers])),
+                    fmt_bytes(mean([x.get('private_dirty') for x in workers])),
+                ]
+                name = hist.get('task_name') or task_uuid
+                print('    %-24s %s' % (name[:24], ' '.join(['%-16s' % x for x in line])))
+
+
+def main_run(bdir):
+    ''' (run id, meta) of the longest play in a results dir, skipping the localhost one '''
+    runs = [x for x in load_runs(bdir, 'meta.json').items() if x[1].get('stop')]
+    if not runs:
+        return None, None
+    return max(runs, key=lambda x: x[1]['stop'] - x[1]['start'])
+
+
+def run_summary(bdir):
+    run_id, meta = main_run(bdir)
+    if run_id is None:
+        return None
+    wall = meta['stop'] - meta['start']
+    hists = load_runs(bdir, 'histograms.json').get(run_id, {}).get('run', {})
+    workers = []
+    fn = os.path.join(bdir, '%s_workers.ndjson' % run_id)
+    if os.path.exists(fn):
+        workers = load_workers(fn)
+    gc = meta.get('gc') or {}
+    affinity = meta.get('affinity') or {}
+    ctx_switches = None
+    if affinity.get('voluntary_switches') is not None:
+        ctx_switches = affinity['voluntary_switches'] + affinity['involuntary_switches']
+    return OrderedDict([
+        ('strategy', meta.get('strategy') or 'linear'),
+        ('hosts', meta['hosts']),
+        ('forks', meta['forks']),
+        ('dry run', 'yes' if meta.get('dry_run') else '-'),
+        ('gc freeze', gc.get('freeze') or '-'),
+        ('gc threshold', ','.join(str(x) for x in gc['threshold']) if gc.get('threshold') else '-'),
+        ('wall', wall),
+        ('tasks/s', meta['dispatched'] / wall if meta.get('dispatched') is not None else None),
+        ('fork cost p50', hists.get('fork_cost', {}).get('p50')),
+        ('child start p50', percentile([x['start'] - x['fork'] for x in workers if x.get('fork')], 50)),
+        ('minflt', mean([x.get('minflt') for x in workers])),
+        ('majflt', mean([x.get('majflt') for x in workers])),
+        ('worker cpu', mean([(x['utime'] + x['stime']) if x.get('utime') is not None else None for x in workers])),
+        ('pss', mean([x.get('pss') for x in workers])),
+        ('private dirty', mean([x.get('private_dirty') for x in workers])),
+        ('controller cpus', fmt_cpus(affinity.get('controller_cpus'))),
+        ('worker cpus', fmt_cpus(affinity.get('worker_cpus'))),
+        ('ctl migrations', affinity.get('migrations')),
+        ('ctl ctx switches', ctx_switches),
+        ('wkr migrations', mean([x.get('migrations') for x in workers])),
+        ('wkr ivcsw', mean([x.get('ivcsw') for x in workers])),
+    ])
+
+
+def task_walls(bdir):
+    ''' task name -> (hosts, first dispatch to last result processed) for a dir's main play '''
+    run_id, meta = main_run(bdir)
+    if run_id is None:
+        return OrderedDict()
+    names = OrderedDict()
+    spans = {}
+    with open(os.path.join(bdir, '%s_events.ndjson' % run_id), 'r') as f:
+        for line in f:
+            event = json.loads(line)
+            if event[0] == 'task':
+                names[event[2]] = event[3]
+            elif event[0] in ('queue', 'leave'):
+                span = spans.setdefault(event[3], [event[1], event[1], 0])
+                span[0] = min(span[0], event[1])
+                span[1] = max(span[1], event[1])
+                if event[0] == 'queue':
+                    span[2] += 1
+    return OrderedDict(
+        (name, (spans[uuid][2], spans[uuid][1] - spans[uuid][0])) for uuid, name in names.items() if uuid in spans
+    )
+
+
+def report_tasks(args):
+
+    walls = [(bdir, task_walls(bdir)) for bdir in args.dirs]
+    base = walls[0][1]
+    print('%-32s %s' % ('task', ' '.join(['%-24s' % os.path.basename(x[0].rstrip('/'))[:24] for x in walls])))
+    for name in base:
+        line = []
+        for bdir, tasks in walls:
+            if name not in tasks:
+                line.append('%-24s' % '-')
+                continue
+            hosts, wall = tasks[name]
+            cell = '%s/%d' % (fmt_seconds(wall), hosts)
+            if tasks is not base and base[name][1]:
+                cell += ' (x%.2f)' % (base[name][1] / wall if wall else float('inf'))
+            line.append('%-24s' % cell)
+        print('%-32s %s' % (name[:32], ' '.join(line)))
+
+
+def report_compare(args):
+
+    summaries = []
+    for bdir in args.dirs:
+        summary = run_summary(bdir)
+        if summary is None:
+            print('%s: no finished runs' % bdir)
+            continue
+        summaries.append((bdir, summary))
+    if not summaries:
+        return
+    base = summaries[0][1]
+    formats = {'wall': fmt_seconds, 'fork cost p50': fmt_seconds, 'child start p50': fmt_seconds,
+               'worker cpu': fmt_seconds, 'pss': fmt_bytes, 'private dirty': fmt_bytes,
+               'minflt': fmt_number, 'majflt': fmt_number, 'ctl migrations': fmt_number,
+               'ctl ctx switches': fmt_number, 'wkr migrations': fmt_number, 'wkr ivcsw': fmt_number, 'tasks/s': lambda x: '-' if x is None else '%.1f' % x}
+
+    print('%-16s %s' % ('', ' '.join(['%-24s' % os.path.basename(x[0].rstrip('/'))[:24] for x in summaries])))
+    for key in base:
+        line = []
+        for bdir, summary in summaries:
+            value = summary[key]
+            cell = formats.get(key, str)(value)
+            if summary is not base and key in formats and value is not None and base[key]:
+                cell += ' (%+.0f%%)' % ((value - base[key]) / base[key] * 100)
+            line.append('%-24s' % cell)
+        print('%-16s %s' % (key, ' '.join(line)))
+
+
+def report_autotune(args):
+
+    for bdir in args.dirs:
+        for run_id, meta in load_runs(bdir, 'meta.json').items():
+            tune = meta.get('autotune')
+            if not tune or not tune['decisions']:
+                continue
+            settled = max(tune['limit_seconds'], key=lambda x: x[1])[0] if tune['limit_seconds'] else None
+            print('%s %s hosts:%s forks:%s start:%s final:%s best:%s (%.1f hosts/s) longest held:%s' % (
+                bdir, meta.get('strategy') or 'linear', meta['hosts'], meta['forks'], tune['start'],
+                tune['final'], tune['best_limit'], tune['best_throughput'], settled
+            ))
+            if not args.decisions:
+                continue
+            with open(os.path.join(bdir, '%s_events.ndjson' % run_id), 'r') as f:
+                for line in f:
+                    event = json.loads(line)
+                    if event[0] != 'autotune':
+                        continue
+                    ts, old, new, throughput, cpu, throttled, decision = event[1:]
+                    print('    +%-8.1f %3s -> %-3s %8.1f hosts/s  cpu %3.0f%%  throttled %-5s %s' % (
+                        ts - meta['start'], old, new, throughput, cpu * 100, throttled, decision
+                    ))
+
+
+def report_connection(args):
+
+    ops = ['exec', 'put', 'fetch']
+    cols = ['hosts'] + ['%s/host' % x for x in ops] + ['time/host', 'out/host', 'in/host', 'errors']
+    for bdir in args.dirs:
+        for run_id, meta in load_runs(bdir, 'meta.json').items():
+            fn = os.path.join(bdir, '%s_connection.ndjson' % run_id)
+            if not os.path.exists(fn):
+                continue
+            print('%s %s hosts:%s forks:%s' % (bdir, meta.get('strategy') or 'linear', meta['hosts'], meta['forks']))
+            print('    %-24s %-12s %s' % ('task', 'module', ' '.join(['%-10s' % x for x in cols])))
+            # (task uuid, module) -> calls
+            groups = OrderedDict()
+            names = {}
+            for call in load_workers(fn):
+                names[call['task_uuid']] = call['task'] or call['task_uuid']
+                groups.setdefault(call['task_uuid'], []).append(call)
+            for task_uuid, calls in groups.items():
+                # the tmp dir setup and cleanup calls belong to the task's module
+                modules = set(x['module'] for x in calls if x['module'])
+                module = ','.join(sorted(modules)) or '-'
+                hosts = len(set(x['host'] for x in calls))
+                line = [hosts] + ['%.1f' % (len([x for x in calls if x['op'] == op]) / hosts) for op in ops] + [
+                    fmt_seconds(sum(x['end'] - x['start'] for x in calls) / hosts),
+                    '%.1fKB' % (sum(x['bytes_out'] or 0 for x in calls) / hosts / 1024.0),
+                    '%.1fKB' % (sum(x['bytes_in'] or 0 for x in calls) / hosts / 1024.0),
+                    len([x for x in calls if x['error'] or x['rc']]),
+                ]
+                print('    %-24s %-12s %s' % (names[task_uuid][:24], module[:12], ' '.join(['%-10s' % x for x in line])))
+
+
+def fmt_cpus(cpus):
+    ''' [0, 1, 2, 3, 8] -> 0-3,8 '''
+    if not cpus:
+        return '-'
+    ranges = []
+    for cpu in cpus:
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(x) if x == y else '%s-%s' % (x, y) for x, y in ranges)
+
+
+def fmt_bytes(value):
+    if value is None:
+        return '-'
+    return '%.1fMB' % (value / 1024.0 / 1024.0)
+
+
+def fmt_number(value):
+    if value is None:
+        return '-'
+    return '%.0f' % value
+
+
+def fmt_seconds(value):
+    if value is None:
+        return '-'
+    if value < 1:
+        return '%.1fms' % (value * 1000)
+    return '%.2fs' % value
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+
+    runs = subparsers.add_parser('runs', help='wall time and task throughput per play')
+    runs.add_argument('dirs', nargs='+')
+    runs.add_argument('--min-wall', type=float, default=1.0)
+    runs.set_defaults(func=report_runs)
+
+    phases = subparsers.add_parser('phases', help='controller time per scheduling phase (BENCHMARK_PROFILE_PHASES=1)')
+    phases.add_argument('dirs', nargs='+')
+    phases.add_argument('--tasks', action='store_true', help='also break each run down per task')
+    phases.add_argument('--min-wall', type=float, default=1.0)
+    phases.set_defaults(func=report_phases)
+
+    dispatch = subparsers.add_parser('dispatch', help='dispatch latency, worker idle time and queue depth')
+    dispatch.add_argument('dirs', nargs='+')
+    dispatch.add_argument('--min-wall', type=float, default=1.0)
+    dispatch.set_defaults(func=report_dispatch)
+
+    workers = subparsers.add_parser('workers', help='per task fork cost, page faults and memory of the workers')
+    workers.add_argument('dirs', nargs='+')
+    workers.add_argument('--min-wall', type=float, default=1.0)
+    workers.set_defaults(func=report_workers)
+
+    compare = subparsers.add_parser(
+        'compare',
+        help='throughput, fork cost, page faults and worker memory of each dir\'s main play against the first dir'
+    )
+    compare.add_argument('dirs', nargs='+')
+    compare.set_defaults(func=report_compare)
+
+    autotune = subparsers.add_parser('autotune', help='where BENCHMARK_AUTOTUNE settled and why')
+    autotune.add_argument('dirs', nargs='+')
+    autotune.add_argument('--decisions', action='store_true', help='also list every decision')
+    autotune.set_defaults(func=report_autotune)
+
+    tasks = subparsers.add_parser('tasks', help='per task wall time of each dir\'s main play, as speedup over the first dir')
+    tasks.add_argument('dirs', nargs='+')
+    tasks.set_defaults(func=report_tasks)
+
+    connection = subparsers.add_parser(
+        'connection', help='connection round trips, time and bytes per host per task (BENCHMARK_CONNECTION_TELEMETRY=1)'
+    )
+    connection.add_argument('dirs', nargs='+')
+    connection.set_defaults(func=report_connection)
+
+    args = parser.parse_args()
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        sys.exit(1)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
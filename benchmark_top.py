@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+# Live view of a running benchmark strategy's metrics, for spotting a stalled
+# 5000 or 10000 host run without waiting for it to finish.
+#
+#   BENCHMARK_METRICS_PORT=9101 ansible-playbook ... run_scale_strategy.yml
+#   ./benchmark_top.py --port 9101
+#
+#   BENCHMARK_METRICS_SOCKET=/tmp/bench.sock ansible-playbook ...
+#   ./benchmark_top.py --socket /tmp/bench.sock --abort-after 120
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+import argparse
+import os
+import re
+import signal
+import socket
+import sys
+import time
+
+
+METRIC_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)$')
+LABEL_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def scrape(args):
+    ''' raw exposition text from the strategy's port or socket '''
+    if args.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(args.timeout)
+        sock.connect(args.socket)
+    else:
+        sock = socket.create_connection(('127.0.0.1', args.port), timeout=args.timeout)
+        sock.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+    data = b''
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        sock.close()
+    text = data.decode('utf-8')
+    if not args.socket:
+        text = text.split('\r\n\r\n', 1)[-1]
+    return text
+
+
+def parse(text):
+    ''' metric name -> list of (labels dict, value) '''
+    metrics = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        match = METRIC_RE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        labels = dict(
+            (k, v.replace('\\n', '\n').replace('\\"', '"').replace('\\\\', '\\'))
+            for k, v in LABEL_RE.findall(labels or '')
+        )
+        metrics.setdefault(name, []).append((labels, float(value)))
+    return metrics
+
+
+def value(metrics, name, default=0):
+    samples = metrics.get(name)
+    if not samples:
+        return default
+    return samples[0][1]
+
+
+def render(metrics, previous, interval, stalled_for, args):
+    lines = []
+    info = metrics.get('benchmark_info', [({}, 0)])[0][0]
+    rss = value(metrics, 'process_resident_memory_bytes') / 1024.0 / 1024.0
+    cpu = value(metrics, 'process_cpu_seconds_total')
+    cpu_pct = None
+    if previous is not None and previous.get('benchmark_info') == metrics.get('benchmark_info'):
+        cpu_pct = (cpu - value(previous, 'process_cpu_seconds_total')) / interval * 100
+
+    lines.append('%s  strategy:%s  pid:%s  run:%s' % (
+        time.strftime('%H:%M:%S'), info.get('strategy', '-'), info.get('pid', '-'), info.get('run_id', '-')
+    ))
+    lines.append('controller rss:%.1fMB cpu:%s' % (rss, '-' if cpu_pct is None else '%.0f%%' % cpu_pct))
+    lines.append('hosts:%d forks:%d/%d dispatched:%d completed:%d rate:%.1f/s backlog:%d pending:%d' % (
+        value(metrics, 'benchmark_hosts'),
+        value(metrics, 'benchmark_forks_busy'),
+        value(metrics, 'benchmark_forks'),
+        value(metrics, 'benchmark_dispatched_total'),
+        value(metrics, 'benchmark_completed_total'),
+        value(metrics, 'benchmark_dispatch_rate'),
+        value(metrics, 'benchmark_result_backlog'),
+        value(metrics, 'benchmark_pending_results'),
+    ))
+    if stalled_for >= args.stall:
+        lines.append('STALLED: no dispatch or result for %.0fs' % stalled_for)
+        if args.abort_after:
+            lines.append('aborting the run at %.0fs' % args.abort_after)
+    lines.append('')
+
+    completed = dict(
+        (labels['task_uuid'], v) for labels, v in metrics.get('benchmark_task_completed_total', [])
+    )
+    lines.append('%-40s %10s %10s %10s' % ('task', 'dispatched', 'completed', 'in flight'))
+    for labels, dispatched in metrics.get('benchmark_task_dispatched_total', []):
+        done = completed.get(labels['task_uuid'], 0)
+        lines.append('%-40s %10d %10d %10d' % (labels['task'][:40], dispatched, done, dispatched - done))
+    return '\n'.join(lines)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--port', type=int, help='BENCHMARK_METRICS_PORT of the run')
+    target.add_argument('--socket', help='BENCHMARK_METRICS_SOCKET of the run')
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--stall', type=float, default=30.0,
+                        help='seconds without a dispatch or a result before the run is flagged as stalled')
+    parser.add_argument('--abort-after', type=float, default=None,
+                        help='send SIGINT to the controller once it has been stalled this long')
+    parser.add_argument('--once', action='store_true', help='print one snapshot and exit')
+    args = parser.parse_args()
+
+    previous = None
+    while True:
+        try:
+            metrics = parse(scrape(args))
+        except (socket.error, socket.timeout) as e:
+            if previous is None or args.once:
+                sys.exit('cannot read metrics: %s' % e)
+            # the controller has exited
+            print('\nmetrics went away: %s' % e)
+            break
+
+        now = time.time()
+        last = max(
+            value(metrics, 'benchmark_last_dispatch_timestamp_seconds'),
+            value(metrics, 'benchmark_last_result_timestamp_seconds')
+        )
+        busy = value(metrics, 'benchmark_pending_results') > 0
+        stalled_for = now - last if last and busy else 0.0
+
+        screen = render(metrics, previous, args.interval, stalled_for, args)
+        if args.once:
+            print(screen)
+            break
+        sys.stdout.write('\x1b[H\x1b[2J' + screen + '\n')
+        sys.stdout.flush()
+
+        if args.abort_after and stalled_for >= args.abort_after:
+            pid = metrics.get('benchmark_info', [({}, 0)])[0][0].get('pid')
+            if pid:
+                print('sending SIGINT to %s' % pid)
+                os.kill(int(pid), signal.SIGINT)
+            break
+
+        previous = metrics
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
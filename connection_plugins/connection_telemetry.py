@@ -0,0 +1,246 @@
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+# Per-call telemetry shared by the benchmark connection plugins. Not a
+# connection plugin itself: noop, replay and ssh_killer decorate their
+# exec_command, put_file and fetch_file with @recorded, and with
+# BENCHMARK_CONNECTION_TELEMETRY=1 every call under a benchmark strategy
+# appends one line to $BENCHMARK_RESULTS/<run>_connection.ndjson. The first
+# line is a header naming the columns, as in *_workers.ndjson.
+#
+# ssh_killer's record mode (@recording) and the replay connection share the
+# recording archive format from here too: a directory with one NDJSON file
+# per host, so a replaying worker only reads the host it is serving.
+
+import base64
+import fcntl
+import json
+import os
+import re
+import time
+import zlib
+
+from functools import wraps
+
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_bytes, to_text
+
+
+FIELDS = ['pid', 'connection', 'op', 'host', 'task_uuid', 'task', 'module',
+          'start', 'end', 'bytes_out', 'bytes_in', 'rc', 'error']
+
+# one recorded call; n counts the calls with the same op and module within
+# the task, output is stdout (or a fetched file) and stderr, each zlib
+# compressed and base64 encoded, and error is [exception class, message] for
+# a call that raised
+RECORDING_FIELDS = ['task', 'op', 'module', 'n', 'start', 'duration', 'rc', 'stdout', 'stderr', 'error']
+
+# the module's file name when it is copied over, or its payload dir when it
+# is piped into the interpreter
+MODULE_RE = re.compile(r'AnsiballZ_(\w+)\.py|ansible_(\w+)_payload_')
+
+
+def module_name(cmd, in_data=None):
+    ''' the module a command runs, or None for tmp dir setup, cleanup and the like '''
+    for text in (cmd, in_data):
+        match = MODULE_RE.search(to_text(text or '', errors='surrogate_or_strict'))
+        if match:
+            return match.group(1) or match.group(2)
+    return None
+
+
+def telemetry_path():
+    ''' where this play's records go, or None when telemetry is off '''
+    run_id = os.environ.get('BENCHMARK_RUN_ID')
+    if not run_id or os.environ.get('BENCHMARK_CONNECTION_TELEMETRY', '0') != '1':
+        return None
+    return os.path.join(os.environ.get('BENCHMARK_RESULTS', 'benchmark_results'), '%s_connection.ndjson' % run_id)
+
+
+def write_record(path, record, fields=FIELDS):
+    '''
+    Append one record. Every worker of the play appends to the same file, so
+    the header check and the write happen under an exclusive flock.
+    '''
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        data = json.dumps(record, separators=(',', ':')) + '\n'
+        if os.fstat(fd).st_size == 0:
+            data = json.dumps({'fields': fields}) + '\n' + data
+        os.write(fd, to_bytes(data))
+    finally:
+        os.close(fd)
+
+
+def _size(path):
+    try:
+        return os.path.getsize(to_bytes(path, errors='surrogate_or_strict'))
+    except (IOError, OSError):
+        return None
+
+
+def _option(connection, name):
+    # options are only set once TaskExecutor has the task's vars
+    try:
+        return connection.get_option(name) or None
+    except KeyError:
+        return None
+
+
+def recorded(op):
+    '''
+    Decorates a connection's exec_command ('exec'), put_file ('put') or
+    fetch_file ('fetch'). bytes_out is the command plus any pipelined input,
+    or the file sent; bytes_in is stdout plus stderr, or the file fetched.
+    A call that raises is recorded with the exception's class as its error.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapped(self, *args, **kwargs):
+            path = telemetry_path()
+            if path is None:
+                return func(self, *args, **kwargs)
+
+            bytes_out = bytes_in = None
+            if op == 'exec':
+                cmd = args[0] if args else kwargs.get('cmd')
+                in_data = args[1] if len(args) > 1 else kwargs.get('in_data')
+                bytes_out = len(to_bytes(cmd)) + len(to_bytes(in_data or b''))
+                module = module_name(cmd, in_data)
+            else:
+                in_path, out_path = args[:2]
+                if op == 'put':
+                    bytes_out = _size(in_path)
+                module = module_name(out_path if op == 'put' else in_path)
+
+            start = time.time()
+            rc = error = None
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception as e:
+                error = e.__class__.__name__
+                raise
+            else:
+                if isinstance(result, tuple) and len(result) == 3:
+                    rc = result[0]
+                    if op == 'exec':
+                        bytes_in = len(to_bytes(result[1] or b'')) + len(to_bytes(result[2] or b''))
+                elif op != 'exec':
+                    rc = 0
+                if op == 'fetch':
+                    bytes_in = _size(args[1])
+                return result
+            finally:
+                write_record(path, [
+                    os.getpid(),
+                    getattr(self, '_load_name', None) or self.transport,
+                    op,
+                    self._play_context.remote_addr,
+                    _option(self, 'task_uuid'),
+                    _option(self, 'task_name'),
+                    module,
+                    start,
+                    time.time(),
+                    bytes_out,
+                    bytes_in,
+                    rc,
+                    error,
+                ])
+        return wrapped
+    return decorator
+
+
+def encode_output(data):
+    if not data:
+        return ''
+    return to_text(base64.b64encode(zlib.compress(to_bytes(data, errors='surrogate_or_strict'))))
+
+
+def decode_output(data):
+    if not data:
+        return b''
+    return zlib.decompress(base64.b64decode(data))
+
+
+def host_recording(archive, host):
+    ''' the file in a recording archive holding one host's calls '''
+    return os.path.join(archive, '%s.ndjson' % to_text(host).replace(os.sep, '_'))
+
+
+def call_index(connection, op, module):
+    ''' how many calls with this op and module the connection has made for its task before this one '''
+    calls = connection.__dict__.setdefault('_recording_calls', {})
+    n = calls.get((op, module), 0)
+    calls[(op, module)] = n + 1
+    return n
+
+
+def recording(op):
+    '''
+    Decorates ssh_killer's exec_command, put_file and fetch_file. When the
+    connection's record_dir option is set, every call is appended to the
+    host's file in that archive, keyed on the task name, op, module and call
+    index, with its timing, rc and output. A fetch records the fetched file
+    as its output so a replay can write it back, and a call that raises
+    (an unreachable host, say) records the exception. Only the benchmark_*
+    strategies pass the task name, and without it every task's calls would
+    share one key, so recording under any other strategy fails the task.
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapped(self, *args, **kwargs):
+            archive = _option(self, 'record_dir')
+            if not archive:
+                return func(self, *args, **kwargs)
+            task = _option(self, 'task_name')
+            if not task:
+                raise AnsibleError('recording to %s needs a benchmark_* strategy, which passes the task name' % archive)
+
+            if op == 'exec':
+                cmd = args[0] if args else kwargs.get('cmd')
+                in_data = args[1] if len(args) > 1 else kwargs.get('in_data')
+                module = module_name(cmd, in_data)
+            else:
+                module = module_name(args[1] if op == 'put' else args[0])
+            n = call_index(self, op, module)
+
+            start = time.time()
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception as e:
+                duration = time.time() - start
+                rc, stdout, stderr = None, b'', b''
+                error = [e.__class__.__name__, to_text(e)]
+                raised = e
+            else:
+                duration = time.time() - start
+                rc, stdout, stderr = result if isinstance(result, tuple) and len(result) == 3 else (0, b'', b'')
+                if op == 'fetch':
+                    with open(to_bytes(args[1], errors='surrogate_or_strict'), 'rb') as f:
+                        stdout = f.read()
+                error = raised = None
+            if not os.path.isdir(archive):
+                try:
+                    os.makedirs(archive)
+                except OSError:
+                    # another worker got there first
+                    pass
+            write_record(host_recording(archive, self._play_context.remote_addr), [
+                task,
+                op,
+                module,
+                n,
+                start,
+                duration,
+                rc,
+                encode_output(stdout),
+                encode_output(stderr),
+                error,
+            ], fields=RECORDING_FIELDS)
+            if raised is not None:
+                raise raised
+            return result
+        return wrapped
+    return decorator
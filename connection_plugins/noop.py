@@ -15,19 +15,158 @@ DOCUMENTATION = '''
         - Ansible does not expose a channel to allow communication between the user and the ssh process to accept
           a password manually to decrypt an ssh key when using this connection plugin (which is the default). The
           use of ``ssh-agent`` is highly recommended.
+        - For benchmarking, every command sleeps for a latency drawn from a seeded model instead of running,
+          and hosts can be made to fail or go unreachable at a given rate. The defaults reproduce the old fixed
+          delays, 0.5s for a module and 0.1s for anything else.
     author: ansible (@core)
     version_added: historical
+    options:
+      latency_distribution:
+        description:
+          - How command latencies are drawn around their base cost. C(fixed) always uses the base cost,
+            C(normal) draws with the base as the mean and I(latency_sigma) x base as the standard deviation,
+            C(lognormal) draws with the base as the median and I(latency_sigma) as the log standard deviation,
+            and C(pareto) with the base as the minimum and I(latency_alpha) as the shape, for a long tail.
+        default: fixed
+        choices: [fixed, normal, lognormal, pareto]
+        env: [{name: NOOP_LATENCY_DISTRIBUTION}]
+        vars: [{name: noop_latency_distribution}]
+      latency:
+        description: Base cost in seconds of a command that is not a module run (tmp dir setup and cleanup).
+        default: 0.1
+        type: float
+        env: [{name: NOOP_LATENCY}]
+        vars: [{name: noop_latency}]
+      module_latency:
+        description: Base cost in seconds of running a module (an AnsiballZ payload).
+        default: 0.5
+        type: float
+        env: [{name: NOOP_MODULE_LATENCY}]
+        vars: [{name: noop_module_latency}]
+      module_costs:
+        description:
+          - Base cost in seconds per module name, overriding I(module_latency), as a dict or as
+            C(setup=2.0,shell=0.3).
+        default: ''
+        env: [{name: NOOP_MODULE_COSTS}]
+        vars: [{name: noop_module_costs}]
+      latency_sigma:
+        description: Spread for the normal (relative to the base) and lognormal distributions.
+        default: 0.5
+        type: float
+        env: [{name: NOOP_LATENCY_SIGMA}]
+        vars: [{name: noop_latency_sigma}]
+      latency_alpha:
+        description: Shape of the pareto distribution; lower values give a heavier tail.
+        default: 3.0
+        type: float
+        env: [{name: NOOP_LATENCY_ALPHA}]
+        vars: [{name: noop_latency_alpha}]
+      host_skew:
+        description:
+          - Log standard deviation of a per-host latency multiplier, drawn once per host from the seed, so
+            some hosts are consistently slow. Without a seed it is drawn from the benchmark run id, so it
+            still holds for the whole run but differs between runs. 0 makes every host the same.
+        default: 0.0
+        type: float
+        env: [{name: NOOP_HOST_SKEW}]
+        vars: [{name: noop_host_skew}]
+      unreachable_rate:
+        description: Probability that a host is unreachable for a task.
+        default: 0.0
+        type: float
+        env: [{name: NOOP_UNREACHABLE_RATE}]
+        vars: [{name: noop_unreachable_rate}]
+      failed_rate:
+        description: Probability that a module run fails.
+        default: 0.0
+        type: float
+        env: [{name: NOOP_FAILED_RATE}]
+        vars: [{name: noop_failed_rate}]
+      seed:
+        description:
+          - Seed for every draw. Each host, task and command gets its own stream derived from it, so a run
+            is reproducible whatever the fork count or dispatch order. Unset draws differently every run.
+        default: ''
+        env: [{name: NOOP_SEED}]
+        vars: [{name: noop_seed}]
+      result_size:
+        description:
+          - Approximate size in bytes of every module result, built like the output of
+            C(playbooks/files/bigdata.py). 0 returns an empty result, as before.
+        default: 0
+        type: float
+        env: [{name: NOOP_RESULT_SIZE}]
+        vars: [{name: noop_result_size}]
+      result_sizes:
+        description:
+          - Result sizes by task name pattern, as a dict or as C(shell.*=1000000,debug*=0). The first
+            pattern matching the task's name wins over I(result_size).
+        default: ''
+        env: [{name: NOOP_RESULT_SIZES}]
+        vars: [{name: noop_result_sizes}]
+      result_size_distribution:
+        description:
+          - How result sizes are drawn around the configured size, with the same choices and I(latency_sigma)
+            and I(latency_alpha) parameters as I(latency_distribution).
+        default: fixed
+        choices: [fixed, normal, lognormal, pareto]
+        env: [{name: NOOP_RESULT_SIZE_DISTRIBUTION}]
+        vars: [{name: noop_result_size_distribution}]
+      facts_interfaces:
+        description:
+          - Network interfaces in each host's C(setup) facts, modeled on the primary one in facts.json.
+            0 keeps the interfaces from facts.json.
+        default: 0
+        type: int
+        env: [{name: NOOP_FACTS_INTERFACES}]
+        vars: [{name: noop_facts_interfaces}]
+      facts_mounts:
+        description: Mounts in each host's C(setup) facts. 0 keeps the mounts from facts.json.
+        default: 0
+        type: int
+        env: [{name: NOOP_FACTS_MOUNTS}]
+        vars: [{name: noop_facts_mounts}]
+      facts_packages:
+        description: Packages added to each host's C(setup) facts as C(packages), shaped like package_facts output.
+        default: 0
+        type: int
+        env: [{name: NOOP_FACTS_PACKAGES}]
+        vars: [{name: noop_facts_packages}]
+      facts_variance:
+        description:
+          - How far each host's interface, mount and package counts stray from the configured ones, as a
+            fraction, so hosts differ in size too. 0.5 gives each host between half and one and a half times.
+        default: 0.0
+        type: float
+        env: [{name: NOOP_FACTS_VARIANCE}]
+        vars: [{name: noop_facts_variance}]
+      task_name:
+        description: Name of the task being run, set by the benchmark strategies to key the seeded draws.
+        default: ''
+        vars: [{name: benchmark_task_name}]
+      task_uuid:
+        description: UUID of the task being run, set by the benchmark strategies for the connection telemetry.
+        default: ''
+        vars: [{name: benchmark_task_uuid}]
 '''
 
 import errno
 import fcntl
+import copy
 import hashlib
+import json
+import math
 import os
 import pty
+import random
 import re
 import subprocess
+import sys
 import time
 
+from collections import OrderedDict
+from fnmatch import fnmatch
 from functools import wraps
 from ansible import constants as C
 from ansible.errors import (
@@ -49,6 +188,258 @@ from ansible.utils.path import unfrackpath, makedirs_safe
 
 display = Display()
 
+# the plugin loader does not put this directory on sys.path
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from connection_telemetry import module_name, recorded
+
+
+def parse_costs(value, option='module_costs'):
+    ''' OrderedDict of name -> number from a dict or 'setup=2.0,shell=0.3', in the order given '''
+    if not value:
+        return OrderedDict()
+    if isinstance(value, dict):
+        return OrderedDict((k, float(v)) for k, v in value.items())
+    costs = OrderedDict()
+    for item in to_text(value).split(','):
+        if not item.strip():
+            continue
+        name, sep, cost = item.partition('=')
+        if not sep:
+            raise AnsibleOptionsError('noop %s entries look like name=number, not %r' % (option, item))
+        costs[name.strip()] = float(cost)
+    return costs
+
+
+def payload(rng, size):
+    '''
+    A module result of about `size` bytes, shaped like the output of
+    playbooks/files/bigdata.py: n keys holding the same random n-character
+    string, with n = sqrt(size).
+    '''
+    n = max(1, int(round(math.sqrt(size))))
+    string = ''.join(rng.choice('abcdef') for x in range(n))
+    return {
+        'argv': ['bigdata.py'],
+        'changed': False,
+        'args': {'size': str(n)},
+        'data': dict(('key_%s' % x, string) for x in range(n)),
+    }
+
+
+FACTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'facts.json')
+
+# facts.json, parsed once per process
+FACTS_TEMPLATE = None
+
+# (host, interfaces, mounts, packages, variance) -> serialized setup result
+FACTS_CACHE = {}
+
+
+def facts_template():
+    global FACTS_TEMPLATE
+    if FACTS_TEMPLATE is None:
+        with open(FACTS_PATH, 'r') as f:
+            FACTS_TEMPLATE = json.loads(f.read())
+    return FACTS_TEMPLATE
+
+
+def host_facts(host, interfaces=0, mounts=0, packages=0, variance=0.0):
+    '''
+    The setup result for one host as a JSON string: facts.json with the
+    host's own name, ids and addresses, and optionally generated interfaces,
+    mounts and packages. Everything is drawn from a generator seeded on the
+    host name, so a host gets the same facts in every worker and every run.
+    Cached per process.
+    '''
+    key = (host, interfaces, mounts, packages, variance)
+    if key in FACTS_CACHE:
+        return FACTS_CACHE[key]
+
+    rng = random.Random('facts:%s' % host)
+
+    def count(n):
+        if not variance:
+            return n
+        return max(0, int(round(n * (1 + rng.uniform(-variance, variance)))))
+
+    def mac():
+        return '52:54:00:%02x:%02x:%02x' % (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+
+    result = copy.deepcopy(facts_template())
+    facts = result['ansible_facts']
+    digest = hashlib.md5(to_bytes(host)).hexdigest()
+    short = host.split('.')[0]
+    facts.update({
+        'ansible_hostname': short,
+        'ansible_nodename': host,
+        'ansible_fqdn': host if '.' in host else '%s.example.com' % host,
+        'ansible_domain': host.partition('.')[2] or 'example.com',
+        'ansible_machine_id': digest,
+        'ansible_product_uuid': '%s-%s-%s-%s-%s' % (digest[:8], digest[8:12], digest[12:16], digest[16:20], digest[20:]),
+        'ansible_product_serial': digest[:12].upper(),
+        'ansible_uptime_seconds': rng.randint(600, 90 * 86400),
+    })
+
+    default = facts['ansible_default_ipv4']
+    primary = facts['ansible_%s' % default['interface'].replace('-', '_')]
+    template_address = default['address']
+    subnet = '10.%d.%d' % (rng.randint(0, 255), rng.randint(0, 255))
+    address = '%s.%d' % (subnet, rng.randint(2, 254))
+    default.update({
+        'address': address,
+        'network': '%s.0' % subnet,
+        'broadcast': '%s.255' % subnet,
+        'gateway': '%s.1' % subnet,
+        'macaddress': mac(),
+    })
+
+    if interfaces:
+        loopback = facts['ansible_lo']
+        for name in facts['ansible_interfaces']:
+            facts.pop('ansible_%s' % name.replace('-', '_'), None)
+        facts['ansible_lo'] = loopback
+        names = ['lo'] + ['eth%d' % n for n in range(max(1, count(interfaces) - 1))]
+        facts['ansible_interfaces'] = names
+        addresses = []
+        for n, name in enumerate(names[1:]):
+            nic = copy.deepcopy(primary)
+            nic['device'] = name
+            nic['macaddress'] = mac() if n else default['macaddress']
+            nic['ipv4'] = {
+                'address': address if not n else '10.%d.%d.%d' % (rng.randint(0, 255), rng.randint(0, 255), rng.randint(2, 254)),
+                'netmask': '255.255.255.0',
+            }
+            addresses.append(nic['ipv4']['address'])
+            facts['ansible_%s' % name] = nic
+        facts['ansible_all_ipv4_addresses'] = addresses
+        default['interface'] = default['alias'] = 'eth0'
+    else:
+        primary['macaddress'] = default['macaddress']
+        primary['ipv4'] = dict(primary['ipv4'], address=address, network=default['network'], broadcast=default['broadcast'])
+        facts['ansible_all_ipv4_addresses'] = [
+            address if x == template_address else x for x in facts['ansible_all_ipv4_addresses']
+        ]
+
+    if mounts:
+        model = facts['ansible_mounts'][0]
+        facts['ansible_mounts'] = []
+        for n in range(count(mounts)):
+            mount = dict(model)
+            total = rng.randint(1 << 15, 1 << 22)
+            used = rng.randint(0, total)
+            mount.update({
+                'device': '/dev/vd%s%d' % (chr(ord('a') + n // 16 % 26), n % 16 + 1),
+                'fstype': rng.choice(['xfs', 'ext4']),
+                'mount': '/' if not n else '/srv/data%d' % n,
+                'options': 'rw,relatime',
+                'block_size': 4096,
+                'block_total': total,
+                'block_used': used,
+                'block_available': total - used,
+                'size_total': total * 4096,
+                'size_available': (total - used) * 4096,
+                'inode_total': total // 4,
+                'inode_used': used // 4,
+                'inode_available': (total - used) // 4,
+                'uuid': '%08x-%04x-%04x-%04x-%012x' % (rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(16),
+                                                        rng.getrandbits(16), rng.getrandbits(48)),
+            })
+            facts['ansible_mounts'].append(mount)
+
+    if packages:
+        facts['packages'] = {}
+        for n in range(count(packages)):
+            name = 'pkg-%s-%d' % (digest[n % 32], n)
+            facts['packages'][name] = [{
+                'name': name,
+                'version': '%d.%d.%d' % (rng.randint(0, 9), rng.randint(0, 30), rng.randint(0, 200)),
+                'release': '%d.el8' % rng.randint(1, 20),
+                'epoch': None,
+                'arch': 'x86_64',
+                'source': 'rpm',
+            }]
+
+    FACTS_CACHE[key] = json.dumps(result)
+    return FACTS_CACHE[key]
+
+
+class LatencyModel(object):
+    '''
+    Draws the latency, the injected failures and the result size for the
+    commands of one host and task. With a seed each draw comes from a stream
+    keyed on the seed, host, task and command, so it does not depend on which
+    worker runs the task or when.
+    '''
+
+    def __init__(self, options, host):
+        self.distribution = options['latency_distribution']
+        self.latency = options['latency']
+        self.module_latency = options['module_latency']
+        self.module_costs = parse_costs(options['module_costs'])
+        self.sigma = options['latency_sigma']
+        self.alpha = options['latency_alpha']
+        self.unreachable_rate = options['unreachable_rate']
+        self.failed_rate = options['failed_rate']
+        self.result_size = options['result_size']
+        self.result_sizes = parse_costs(options['result_sizes'], 'result_sizes')
+        self.result_size_distribution = options['result_size_distribution']
+        self.seed = options['seed']
+        self.host = host
+        self.task = options['task_name']
+        self.calls = 0
+        self.skew = 1.0
+        if options['host_skew']:
+            rng = self._random('skew')
+            if rng is random:
+                # unseeded it still has to be one multiplier per host for the run, not one per connection
+                rng = random.Random('%s:%s:skew' % (os.environ.get('BENCHMARK_RUN_ID', ''), host))
+            self.skew = math.exp(rng.gauss(0, options['host_skew']))
+
+    def _random(self, *key):
+        if self.seed in (None, ''):
+            return random
+        return random.Random('%s:%s:%s' % (self.seed, self.host, ':'.join(str(x) for x in key)))
+
+    def unreachable(self):
+        return self.unreachable_rate > 0 and self._random(self.task, 'unreachable').random() < self.unreachable_rate
+
+    def failed(self, module):
+        return self.failed_rate > 0 and self._random(self.task, module, 'failed').random() < self.failed_rate
+
+    def _sample(self, rng, distribution, base):
+        if distribution == 'normal':
+            return rng.gauss(base, base * self.sigma)
+        elif distribution == 'lognormal':
+            return base * rng.lognormvariate(0, self.sigma)
+        elif distribution == 'pareto':
+            return base * rng.paretovariate(self.alpha)
+        return base
+
+    def draw(self, module=None):
+        ''' seconds the next command takes; module is None for anything but a module run '''
+        self.calls += 1
+        if module is None:
+            base = self.latency
+        else:
+            base = self.module_costs.get(module, self.module_latency)
+        value = self._sample(self._random(self.task, module, self.calls), self.distribution, base)
+        return max(0.0, value * self.skew)
+
+    def payload(self, module):
+        ''' the module result for this task, or None for the old empty one '''
+        base = self.result_size
+        for pattern, size in self.result_sizes.items():
+            if fnmatch(self.task, pattern):
+                base = size
+                break
+        if not base:
+            return None
+        rng = self._random(self.task, module, 'result')
+        return payload(rng, max(0.0, self._sample(rng, self.result_size_distribution, base)))
+
 
 class Connection(ConnectionBase):
     ''' ssh based connections '''
@@ -59,14 +450,31 @@ class Connection(ConnectionBase):
     def __init__(self, play_context, new_stdin, *args, **kwargs):
         super(Connection, self).__init__(play_context, new_stdin, *args, **kwargs)
         self.host = self._play_context.remote_addr
+        self._model = None
+
+    @property
+    def model(self):
+        # options are only set after the connection is created
+        if self._model is None:
+            options = dict((x, self.get_option(x)) for x in (
+                'latency_distribution', 'latency', 'module_latency', 'module_costs', 'latency_sigma',
+                'latency_alpha', 'host_skew', 'unreachable_rate', 'failed_rate', 'seed', 'task_name',
+                'result_size', 'result_sizes', 'result_size_distribution'
+            ))
+            self._model = LatencyModel(options, self.host)
+        return self._model
 
     def _connect(self):
+        if not self._connected and self.model.unreachable():
+            time.sleep(self.model.draw())
+            raise AnsibleConnectionFailure('noop: %s injected unreachable' % self.host)
         self._connected = True
         return self
 
     #
     # Main public methods
     #
+    @recorded('exec')
     def exec_command(self, cmd, in_data=None, sudoable=True):
         ''' run a command on the remote host '''
 
@@ -76,20 +484,34 @@ class Connection(ConnectionBase):
 
         # introduce arbitrary delay to demonstrate fork counts are also 
         # dependant on how long the workers take to finish
-        if 'python' in cmd and 'AnsiballZ' in cmd:
-            time.sleep(.5)
-        else:
-            time.sleep(.1)
+        module = None
+        if 'python' in cmd:
+            # with pipelining the module comes in on stdin
+            module = module_name(cmd, in_data)
+        time.sleep(self.model.draw(module))
 
         #print(cmd)
-        if 'python' in cmd and 'AnsiballZ' in cmd and '_setup.py' in cmd:
-            jfile = 'connection_plugins/facts.json'
-            with open(jfile, 'r') as f:
-                jdata = f.read()
+        if module is not None and self.model.failed(module):
+            return (1, '{"failed": true, "msg": "noop: injected failure"}', '')
+
+        if module == 'setup':
+            jdata = host_facts(
+                self.host,
+                interfaces=self.get_option('facts_interfaces'),
+                mounts=self.get_option('facts_mounts'),
+                packages=self.get_option('facts_packages'),
+                variance=self.get_option('facts_variance')
+            )
             return (0, jdata, '')
 
+        if module is not None:
+            result = self.model.payload(module)
+            if result is not None:
+                return (0, json.dumps(result), '')
+
         return (0, '{}', '')
 
+    @recorded('put')
     def put_file(self, in_path, out_path):
         ''' transfer a file from local to remote '''
 
@@ -99,6 +521,7 @@ class Connection(ConnectionBase):
 
         return (0, '{}', '')
 
+    @recorded('fetch')
     def fetch_file(self, in_path, out_path):
         ''' fetch a file from remote to local '''
 
@@ -0,0 +1,205 @@
+# Copyright (c) 2017 Ansible Project
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    connection: replay
+    short_description: serve commands from a recorded ssh_killer run
+    description:
+        - Never reaches a host. Every command, file transfer and fetch is answered from an archive recorded with
+          the ssh_killer connection's I(record_dir), with the recorded stdout, stderr and rc, after the recorded
+          time scaled by I(time_scale). A call that raised when it was recorded, such as an unreachable host,
+          raises the same Ansible exception.
+        - Calls are matched on the task name, the op, the module and how many such calls the task has made, so
+          the same playbook replays call for call, with or without pipelining. A task that was not recorded
+          falls back to the same call from any recorded task, then to an empty result.
+        - Only the benchmark_* strategies pass the task name, so recording and replaying both need one of them.
+        - Hosts that are not in the archive are mapped onto a recorded host by a hash of their name, so a run
+          with ten times the recorded hosts replays each recorded host's behaviour about ten times.
+    author: ansible (@core)
+    version_added: historical
+    options:
+      archive:
+        description: Recording directory written by ssh_killer's I(record_dir).
+        required: true
+        env: [{name: REPLAY_ARCHIVE}]
+        vars: [{name: replay_archive}]
+      time_scale:
+        description: Multiplier on every recorded duration; 0 replays without waiting.
+        default: 1.0
+        type: float
+        env: [{name: REPLAY_TIME_SCALE}]
+        vars: [{name: replay_time_scale}]
+      task_name:
+        description: Name of the task being run, set by the benchmark strategies to find its recorded calls.
+        default: ''
+        vars: [{name: benchmark_task_name}]
+      task_uuid:
+        description: UUID of the task being run, set by the benchmark strategies for the connection telemetry.
+        default: ''
+        vars: [{name: benchmark_task_uuid}]
+'''
+
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+
+from ansible import errors
+from ansible.errors import AnsibleError, AnsibleOptionsError
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.plugins.connection import ConnectionBase
+from ansible.utils.display import Display
+from ansible.utils.path import makedirs_safe
+
+display = Display()
+
+# the plugin loader does not put this directory on sys.path
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from connection_telemetry import call_index, decode_output, host_recording, module_name, recorded
+
+# the remote tmp dir name in a mkdir command and in its output
+TMP_RE = re.compile(br'ansible-tmp-[0-9.]+-\d+-\d+')
+
+# archive -> recorded host names, sorted
+HOSTS = {}
+
+# (archive, host) -> {(task, op, module, n): call}, parsed once per process
+RECORDINGS = {}
+
+
+def recorded_host(archive, host):
+    ''' the recorded host whose calls this host replays '''
+    if os.path.exists(host_recording(archive, host)):
+        return host
+    if archive not in HOSTS:
+        HOSTS[archive] = sorted(x[:-len('.ndjson')] for x in os.listdir(archive) if x.endswith('.ndjson'))
+    if not HOSTS[archive]:
+        raise AnsibleError('replay: no hosts recorded in %s' % archive)
+    digest = hashlib.md5(to_bytes(host)).hexdigest()
+    return HOSTS[archive][int(digest, 16) % len(HOSTS[archive])]
+
+
+def recorded_error(name, message):
+    ''' the exception a recorded call raised, as an Ansible one '''
+    cls = getattr(errors, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, AnsibleError)):
+        return AnsibleError('%s: %s' % (name, message))
+    return cls(message)
+
+
+def load_recording(archive, host):
+    '''
+    A recorded host's calls, keyed on (task, op, module, n), plus each call
+    under a None task for tasks that were not recorded, first one wins.
+    '''
+    key = (archive, host)
+    if key not in RECORDINGS:
+        calls = {}
+        with open(host_recording(archive, host), 'r') as f:
+            fields = json.loads(f.readline())['fields']
+            for line in f:
+                if not line.strip():
+                    continue
+                call = dict(zip(fields, json.loads(line)))
+                calls[(call['task'], call['op'], call['module'], call['n'])] = call
+                calls.setdefault((None, call['op'], call['module'], call['n']), call)
+        RECORDINGS[key] = calls
+    return RECORDINGS[key]
+
+
+class Connection(ConnectionBase):
+    ''' replays a recorded run '''
+
+    transport = 'replay'
+    has_pipelining = True
+
+    def __init__(self, play_context, new_stdin, *args, **kwargs):
+        super(Connection, self).__init__(play_context, new_stdin, *args, **kwargs)
+        self.host = self._play_context.remote_addr
+
+    def _connect(self):
+        self._connected = True
+        return self
+
+    def _replay(self, op, module):
+        ''' the recorded call answering this one, after its (scaled) duration, or None '''
+        archive = self.get_option('archive')
+        if not archive:
+            raise AnsibleOptionsError('the replay connection needs an archive (REPLAY_ARCHIVE)')
+        task = self.get_option('task_name')
+        if not task:
+            raise AnsibleError('the replay connection needs a benchmark_* strategy, which passes the task name')
+        source = recorded_host(archive, self.host)
+        calls = load_recording(archive, source)
+        n = call_index(self, op, module)
+        call = calls.get((task, op, module, n)) or calls.get((None, op, module, n))
+        if call is None:
+            display.vvv(u"REPLAY no recorded %s %s #%d for task %s" % (op, module, n, task), host=self.host)
+            return None
+        time.sleep(call['duration'] * self.get_option('time_scale'))
+        if call.get('error'):
+            raise recorded_error(*call['error'])
+        return call
+
+    #
+    # Main public methods
+    #
+    @recorded('exec')
+    def exec_command(self, cmd, in_data=None, sudoable=True):
+        ''' run a command on the remote host '''
+
+        super(Connection, self).exec_command(cmd, in_data=in_data, sudoable=sudoable)
+
+        display.vvv(u"REPLAY EXEC {0}".format(cmd), host=self.host)
+
+        call = self._replay('exec', module_name(cmd, in_data))
+        if call is None:
+            return (0, '{}', '')
+
+        stdout = decode_output(call['stdout'])
+        # the controller looks for the tmp dir name it just asked for
+        recorded_tmp = TMP_RE.search(stdout)
+        new_tmp = TMP_RE.search(to_bytes(cmd))
+        if recorded_tmp and new_tmp:
+            stdout = stdout.replace(recorded_tmp.group(0), new_tmp.group(0))
+        return (call['rc'], stdout, decode_output(call['stderr']))
+
+    @recorded('put')
+    def put_file(self, in_path, out_path):
+        ''' transfer a file from local to remote '''
+
+        super(Connection, self).put_file(in_path, out_path)
+
+        display.vvv(u"REPLAY PUT {0} TO {1}".format(in_path, out_path), host=self.host)
+
+        call = self._replay('put', module_name(out_path))
+        if call is None:
+            return (0, '', '')
+        return (call['rc'], decode_output(call['stdout']), decode_output(call['stderr']))
+
+    @recorded('fetch')
+    def fetch_file(self, in_path, out_path):
+        ''' fetch a file from remote to local '''
+
+        super(Connection, self).fetch_file(in_path, out_path)
+
+        display.vvv(u"REPLAY FETCH {0} TO {1}".format(in_path, out_path), host=self.host)
+
+        call = self._replay('fetch', module_name(in_path))
+        if call is None:
+            raise AnsibleError('replay: no recorded fetch of %s for %s' % (to_text(in_path), self.host))
+        makedirs_safe(os.path.dirname(to_text(out_path)))
+        with open(to_bytes(out_path, errors='surrogate_or_strict'), 'wb') as f:
+            f.write(decode_output(call['stdout']))
+        return (call['rc'], '', '')
+
+    def close(self):
+        self._connected = False
@@ -258,6 +258,21 @@ DOCUMENTATION = '''
         vars:
           - name: ansible_scp_if_ssh
             version_added: '2.7'
+      record_dir:
+        description:
+          - Record every command's stdout, stderr, rc and timing, and every fetched file, per host and task
+            into this archive directory, for the replay connection to serve later.
+        default: ''
+        env: [{name: SSH_KILLER_RECORD}]
+        vars: [{name: ssh_killer_record}]
+      task_name:
+        description: Name of the task being run, set by the benchmark strategies for the connection telemetry and recordings.
+        default: ''
+        vars: [{name: benchmark_task_name}]
+      task_uuid:
+        description: UUID of the task being run, set by the benchmark strategies for the connection telemetry.
+        default: ''
+        vars: [{name: benchmark_task_uuid}]
       use_tty:
         version_added: '2.5'
         default: 'yes'
@@ -278,6 +293,7 @@ import os
 import pty
 import re
 import subprocess
+import sys
 import time
 
 import psutil
@@ -303,6 +319,13 @@ from ansible.utils.path import unfrackpath, makedirs_safe
 
 display = Display()
 
+# the plugin loader does not put this directory on sys.path
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from connection_telemetry import recorded, recording
+
 
 b_NOT_SSH_ERRORS = (b'Traceback (most recent call last):',  # Python-2.6 when there's an exception
                                                             # while invoking a script via -m
@@ -1176,6 +1199,8 @@ class Connection(ConnectionBase):
     #
     # Main public methods
     #
+    @recording('exec')
+    @recorded('exec')
     def exec_command(self, cmd, in_data=None, sudoable=True):
         ''' run a command on the remote host '''
 
@@ -1220,6 +1245,8 @@ class Connection(ConnectionBase):
 
         return (returncode, stdout, stderr)
 
+    @recording('put')
+    @recorded('put')
     def put_file(self, in_path, out_path):
         ''' transfer a file from local to remote '''
 
@@ -1234,6 +1261,8 @@ class Connection(ConnectionBase):
 
         return self._file_transport_command(in_path, out_path, 'put')
 
+    @recording('fetch')
+    @recorded('fetch')
     def fetch_file(self, in_path, out_path):
         ''' fetch a file from remote to local '''
 
@@ -4,6 +4,7 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 
+import bisect
 import copy
 import glob
 import json
@@ -76,38 +77,305 @@ def load_perf(fn, meta=None):
     return nobs
 
 
+def load_pslog(fn):
+
+    #  PID  PPID  PGID   SID %CPU %MEM CMD
+    logger.info('process ps log')
+    with open(fn, 'r') as f:
+        psraw = f.read()
+
+    psobs = OrderedDict()
+    _obs = None
+    for line in psraw.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            if _obs is not None:
+                psobs[_obs['time']] = _obs
+            _obs = {
+                'time': float(line.replace('#', '').strip()),
+                'playbook_pids': 0,
+                'playbook_cpu': 0.0,
+                'playbook_mem': 0.0,
+                'cpu': 0.0,
+                'mem': 0.0,
+            }
+            continue
+        if not line[0].isdigit():
+            continue
+        cols = line.split(None, 6)
+        if cols[0] == 'PID':
+            continue
+        if _obs is None or len(cols) < 6:
+            logger.warning('skipping malformed ps.log line: %s' % line)
+            continue
+        _obs['cpu'] += float(cols[4])
+        _obs['mem'] += float(cols[5])
+
+        if 'ansible-playbook' in line:
+            _obs['playbook_pids'] += 1
+            _obs['playbook_cpu'] += float(cols[4])
+            _obs['playbook_mem'] += float(cols[5])
+
+    if _obs:
+        psobs[_obs['time']] = _obs
+
+    return psobs
+
+
+def load_pssamples(fn):
+
+    # written by the benchmark strategy's ProcessTreeSampler
+    logger.info('process ps samples')
+    psobs = OrderedDict()
+    with open(fn, 'r') as f:
+        header = json.loads(f.readline())
+        cols = dict((x, idx) for idx,x in enumerate(header['fields']))
+        last_ts = None
+        for line in f:
+            if not line.strip():
+                continue
+            # a killed run can leave a truncated final line
+            try:
+                ts, cost, procs = json.loads(line)
+            except ValueError:
+                break
+            elapsed = (ts - last_ts) if last_ts else header['interval']
+            last_ts = ts
+            _obs = {
+                'time': ts,
+                'sample_cost': cost,
+                'playbook_pids': 0,
+                'playbook_cpu': 0.0,
+                'playbook_rss_mb': 0.0,
+                'ssh_pids': 0,
+                'ssh_cpu': 0.0,
+            }
+            pss = None
+            for proc in procs:
+                cpu = proc[cols['cpu']] / elapsed * 100.0
+                if proc[cols['name']] in ('ssh', 'sshpass'):
+                    _obs['ssh_pids'] += 1
+                    _obs['ssh_cpu'] += cpu
+                else:
+                    _obs['playbook_pids'] += 1
+                    _obs['playbook_cpu'] += cpu
+                _obs['playbook_rss_mb'] += proc[cols['rss']] / 1048576.0
+                if proc[cols['pss']] is not None:
+                    pss = (pss or 0.0) + proc[cols['pss']] / 1048576.0
+            if pss is not None:
+                _obs['playbook_pss_mb'] = pss
+            psobs[ts] = _obs
+
+    return psobs
+
+
+def load_events(fn):
+
+    # written by the benchmark strategy's EventWriter, one json array per line
+    logger.info('load events')
+    events = []
+    with open(fn, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            # a killed run can leave a truncated final line
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                break
+    return events
+
+
+def events_to_records(events):
+
+    task_names = {}
+    host_queue_starts = []
+    transitions = []
+    snapshots = []
+    receipts = {}
+    for event in events:
+        if event[0] == 'task':
+            task_names[event[2]] = event[3]
+        elif event[0] == 'queue':
+            host_queue_starts.append({
+                'host': event[2],
+                'task_uuid': event[3],
+                'task_name': task_names.get(event[3]),
+                'time': event[1]
+            })
+            # a dispatch is the host entering a worker
+            transitions.append(['enter', event[1], event[2], event[3]])
+        elif event[0] == 'leave':
+            transitions.append(event)
+        elif event[0] == 'recv':
+            receipts[(event[2], event[3])] = event[1]
+        elif event[0] == 'active':
+            # event logs written before enter/leave transitions existed
+            snapshots.append({
+                'time': event[1],
+                'task_uuid': event[2],
+                'active': event[3]
+            })
+    if snapshots:
+        transitions = snapshots_to_transitions(snapshots)
+    return host_queue_starts, transitions, receipts
+
+
+def load_workers(fn):
+
+    # one line per WorkerProcess, appended by the worker itself on exit
+    logger.info('load workers')
+    workers = {}
+    with open(fn, 'r') as f:
+        header = json.loads(f.readline())
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                worker = dict(zip(header['fields'], json.loads(line)))
+            except ValueError:
+                continue
+            workers[(worker['host'], worker['task_uuid'])] = worker
+    return workers
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': values[int(len(values) * .5)],
+        'p95': values[min(len(values) - 1, int(len(values) * .95))],
+        'max': values[-1]
+    }
+
+
+def snapshots_to_transitions(concurrent_hosts):
+
+    # diff consecutive active-host snapshots into enter/leave events
+    transitions = []
+    occupants = {}
+    for ch in concurrent_hosts:
+        active = set(ch['active'])
+        for hn in list(occupants.keys()):
+            if hn not in active:
+                transitions.append(['leave', ch['time'], hn, occupants.pop(hn)])
+        for hn in ch['active']:
+            if hn not in occupants:
+                occupants[hn] = ch['task_uuid']
+                transitions.append(['enter', ch['time'], hn, ch['task_uuid']])
+    return transitions
+
+
+class Occupancy(object):
+
+    '''
+    Rebuilds which hosts occupy a worker at any instant from the strategy's
+    enter/leave events. A copy of the active set is kept every `checkpoint`
+    transitions so that active_at() only replays a short tail.
+    '''
+
+    def __init__(self, transitions, checkpoint=1000):
+        self.transitions = sorted(transitions, key=lambda x: x[1])
+        self.times = [x[1] for x in self.transitions]
+        self.checkpoint = checkpoint
+        self.checkpoints = []
+        self.hosts = set()
+
+        active = set()
+        for idx,transition in enumerate(self.transitions):
+            if idx % checkpoint == 0:
+                self.checkpoints.append(frozenset(active))
+            self._apply(active, transition)
+            self.hosts.add(transition[2])
+
+    @staticmethod
+    def _apply(active, transition):
+        if transition[0] == 'enter':
+            active.add(transition[2])
+        else:
+            active.discard(transition[2])
+
+    def active_at(self, ts):
+        ''' the set of hosts in a worker at time ts '''
+        idx = bisect.bisect_right(self.times, ts)
+        if not idx:
+            return set()
+        cp = (idx - 1) // self.checkpoint
+        active = set(self.checkpoints[cp])
+        for transition in self.transitions[cp * self.checkpoint:idx]:
+            self._apply(active, transition)
+        return active
+
+    def replay(self):
+        ''' yields (transition, number of active hosts after it) '''
+        active = set()
+        for transition in self.transitions:
+            self._apply(active, transition)
+            yield transition, len(active)
+
+    def intervals(self):
+        ''' yields (host, task_uuid, enter time, leave time or None) '''
+        entered = {}
+        for kind, ts, hn, tuuid in self.transitions:
+            if kind == 'enter':
+                entered[hn] = (tuuid, ts)
+            elif hn in entered:
+                tuuid, start = entered.pop(hn)
+                yield hn, tuuid, start, ts
+        for hn, (tuuid, start) in entered.items():
+            yield hn, tuuid, start, None
+
+
 def process_files(files):
 
     logger.info('reading files')
+    psobs = OrderedDict()
+    perfdata = OrderedDict()
+    receipts = {}
+    workers = {}
     for fn in files:
         if 'host_queue_starts' in fn:
             with open(fn, 'r') as f:
                 host_queue_starts = json.loads(f.read())
         elif 'concurrent_hosts' in fn:
             with open(fn, 'r') as f:
-                concurrent_hosts = json.loads(f.read())
+                transitions = snapshots_to_transitions(json.loads(f.read()))
         elif fn.endswith('ps.log'):
-            with open(fn, 'r') as f:
-                psraw = f.read()
+            psobs = load_pslog(fn)
+        elif fn.endswith('_ps.ndjson'):
+            psobs = load_pssamples(fn)
+        elif fn.endswith('_events.ndjson'):
+            events = load_events(fn)
+            host_queue_starts, transitions, receipts = events_to_records(events)
+        elif fn.endswith('_workers.ndjson'):
+            workers = load_workers(fn)
         elif 'meta' in fn:
             with open(fn, 'r') as f:
                 meta = json.loads(f.read())
         elif os.path.basename(fn) == 'perf.csv':
             perfdata = load_perf(fn, meta=meta)
 
+    # the meta of a run that never finished has no stop time
+    if meta.get('stop') is None:
+        meta['stop'] = max([x['time'] for x in host_queue_starts] or [meta['start']])
+
     logger.info('indexing tasks')
     # index all the tasks
     tasks = OrderedDict()
+    task_names = {}
     for hqs in host_queue_starts:
         tuuid = hqs['task_uuid']
         hn = hqs['host']
-        tn = hqs['task_name']
         ts = hqs['time']
 
         if tuuid not in tasks:
             tasks[tuuid] = {}
-
-        tasknum = list(tasks.keys()).index(tuuid)
+            task_names[tuuid] = hqs['task_name']
 
         tasks[tuuid][hn] = {
             'host': hn,
@@ -117,105 +385,70 @@ def process_files(files):
             'duration': meta['stop'] - ts
         }
 
-        for ch in concurrent_hosts:
-            if ch['time'] < ts:
-                continue
-            if ch['time'] > ts and hn not in ch['active']:
-                tasks[tuuid][hn]['stop'] = ch['time']
-                tasks[tuuid][hn]['duration'] = ch['time'] - tasks[tuuid][hn]['start']
-                break
-
-    logger.info('find all hosts and set obs timestamps')
-    # find all hosts and set observation timestamps
-    hosts = set()
+    occupancy = Occupancy(transitions)
+    for hn, tuuid, start, stop in occupancy.intervals():
+        if stop is None or hn not in tasks.get(tuuid, {}):
+            continue
+        tasks[tuuid][hn]['stop'] = stop
+        tasks[tuuid][hn]['duration'] = stop - tasks[tuuid][hn]['start']
+        tasks[tuuid][hn]['processed'] = stop
+
+    # exact stage timings where the strategy recorded them:
+    #   queue_wait  dispatch -> worker process running
+    #   execution   worker run() start -> end
+    #   transit     worker end -> result off the final queue
+    #   processing  result off the queue -> host unblocked
+    logger.info('compute host latencies')
+    stages = ('queue_wait', 'execution', 'transit', 'processing')
+    latencies = OrderedDict()
+    for tuuid,thosts in tasks.items():
+        tstages = dict((x, []) for x in stages)
+        for hn,hd in thosts.items():
+            worker = workers.get((hn, tuuid))
+            recv = receipts.get((hn, tuuid))
+            if recv is not None:
+                hd['stop'] = recv
+                hd['duration'] = recv - hd['start']
+            if worker is not None:
+                tstages['queue_wait'].append(worker['start'] - hd['start'])
+                tstages['execution'].append(worker['end'] - worker['start'])
+                if recv is not None:
+                    tstages['transit'].append(recv - worker['end'])
+            if recv is not None and 'processed' in hd:
+                tstages['processing'].append(hd['processed'] - recv)
+        latencies[tuuid] = {'task_name': task_names.get(tuuid)}
+        for stage in stages:
+            latencies[tuuid][stage] = summarize(tstages[stage])
+
+    logger.info('replay worker occupancy')
+    hosts = occupancy.hosts
+    task_numbers = dict((x, idx + 1) for idx,x in enumerate(tasks.keys()))
     obs = OrderedDict()
-    for ch in concurrent_hosts:
-        for hn in ch['active']:
-            hosts.add(hn)
-    for ch in concurrent_hosts:
-        obs[ch['time']] = {
-            'time': ch['time'],
-            'task_uuid': ch['task_uuid'],
-            'task_name': ch['task_name'],
-            'task_number': None,
-            'hosts_active': ch['active'],
-            'hosts_remaining': list(hosts)[:]
-        }
-
-    logger.info('calculate hosts remaining')
-    # calculate remaining
-    obs_timestamps = sorted(obs.keys())
     this_uuid = None
     remaining = None
-    for obtsid,obs_timestamp in enumerate(obs_timestamps):
-        observation = obs[obs_timestamp]
-        if this_uuid == None or this_uuid != observation['task_uuid']:
-            print('reset remaining for new task: %s' % observation['task_name'])
-            this_uuid = observation['task_uuid']
-            remaining = list(hosts)[:]
-        for hn in observation['hosts_active']:
-            if hn in remaining:
-                remaining.remove(hn)
-        obs[obs_timestamp]['hosts_remaining'] = remaining[:]
-
-    logger.info('compute sums')
-    tasks_total = None
-    for kts,kd in obs.items():
-        obs[kts]['forks'] = meta['forks']
-        obs[kts]['hosts_active'] = len(kd['hosts_active'])
-        obs[kts]['hosts_remaining'] = len(kd['hosts_remaining'])
-        if kd['task_uuid'] not in tasks:
-            tasks[kd['task_uuid']] = {}
-        try:
-            tn = list(tasks.keys()).index(kd['task_uuid']) + 1
-        except ValueError as e:
-            logger.error(e)
-            import epdb; epdb.st()
-        obs[kts]['task_number'] = tn
-        if tasks_total is None or tn > tasks_total:
-            tasks_total = tn
-
-    #  PID  PPID  PGID   SID %CPU %MEM CMD
-    logger.info('process ps log')
-    _obs = None
-    for line in psraw.split('\n'):
-        line = line.strip()
-        if not line:
-            continue
-        if line.startswith('#'):
-            if _obs is not None:
-                ts = _obs['time']
-                if ts not in obs:
-                    obs[ts] = copy.deepcopy(_obs)
-                else:
-                    obs[ts].update(_obs)
-            _obs = {
-                'time': float(line.replace('#', '').strip()),
-                'playbook_pids': 0,
-                'playbook_cpu': 0.0,
-                'playbook_mem': 0.0,
-                'cpu': 0.0,
-                'mem': 0.0,
-            }
-            continue
-        if not line[0].isdigit():
-            continue
-        cols = line.split(None, 6)
-        if len(cols) < 5:
-            print(cols)
-            import epdb; epdb.st()
-        if cols[0] == 'PID':
-            continue
-        _obs['cpu'] += float(cols[4])
-        _obs['mem'] += float(cols[5])
-
-        if 'ansible-playbook' in line:
-            _obs['playbook_pids'] += 1
-            _obs['playbook_cpu'] += float(cols[4])
-            _obs['playbook_mem'] += float(cols[5])
+    for transition, active in occupancy.replay():
+        kind, ts, hn, tuuid = transition
+        if tuuid not in task_numbers:
+            task_numbers[tuuid] = len(task_numbers) + 1
+        if kind == 'enter':
+            if this_uuid != tuuid:
+                print('reset remaining for new task: %s' % task_names.get(tuuid))
+                this_uuid = tuuid
+                remaining = set(hosts)
+            remaining.discard(hn)
+        obs[ts] = {
+            'time': ts,
+            'task_uuid': tuuid,
+            'task_name': task_names.get(tuuid),
+            'task_number': task_numbers[tuuid],
+            'hosts_active': active,
+            'hosts_remaining': len(remaining) if remaining is not None else len(hosts),
+            'forks': meta['forks']
+        }
+    tasks_total = len(task_numbers) or None
 
-    if _obs:
-        ts = _obs['time']
+    logger.info('merge process samples')
+    for ts,_obs in psobs.items():
         if ts not in obs:
             obs[ts] = copy.deepcopy(_obs)
         else:
@@ -226,7 +459,7 @@ def process_files(files):
         if k not in obs:
             obs[k] = copy.deepcopy(v)
         else:
-            import epdb; epdb.st()
+            obs[k].update(v)
 
     logger.info('filling in missing keys')
     keys = set()
@@ -244,6 +477,7 @@ def process_files(files):
     obs = OrderedDict(tuples)
 
     meta['tasks_total'] = tasks_total
+    meta['latencies'] = latencies
     meta['hosts_total'] = len(list(hosts))
 
     return meta,list(obs.values())
@@ -314,7 +548,8 @@ def main():
         with open(mfile, 'r') as f:
             meta = json.loads(f.read())
     else:
-        files = glob.glob('%s/*.json' % bdir) + ['%s/ps.log' % bdir, '%s/perf.csv' % bdir] 
+        files = glob.glob('%s/*.json' % bdir) + glob.glob('%s/*.ndjson' % bdir)
+        files += [x for x in ['%s/ps.log' % bdir, '%s/perf.csv' % bdir] if os.path.exists(x)]
         meta,obs = process_files(files)
 
         logger.info('writing observations.json')
@@ -1,12 +1,17 @@
 #!/bin/bash
 
 PLAYBOOK=run_scale_strategy.yml
+# benchmark, benchmark_linear, benchmark_free or benchmark_host_pinned
+STRATEGY=${STRATEGY:-benchmark}
 
 for FORKCOUNT in $(seq 100 100); do
     for HOSTCOUNT in $(seq 10000 10000); do
         echo "hosts:$HOSTCOUNT forks:$FORKCOUNT"
         export HOSTCOUNT=$HOSTCOUNT
         export BENCHMARK_RESULTS="results.h${HOSTCOUNT}.f${FORKCOUNT}"
+        if [[ $STRATEGY != "benchmark" ]]; then
+            BENCHMARK_RESULTS="$BENCHMARK_RESULTS.${STRATEGY#benchmark_}"
+        fi
         if [[ -d $BENCHMARK_RESULTS ]];  then
             rm -rf $BENCHMARK_RESULTS
         fi
@@ -16,6 +21,6 @@ for FORKCOUNT in $(seq 100 100); do
         PERF_CMD="$PERF_CMD -e branches -e instructions -e task-clock -e context-switches -e page-faults -e cpu-migrations"
         PERF_CMD="$PERF_CMD -o $PERF_FILE"
         echo "$PERF_CMD"
-        $PERF_CMD $(which ansible-playbook) -i 'localhost,' --forks=$FORKCOUNT $PLAYBOOK
+        $PERF_CMD $(which ansible-playbook) -i 'localhost,' --forks=$FORKCOUNT -e benchmark_strategy=$STRATEGY $PLAYBOOK
     done
 done
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+
+# Discrete-event model of the linear strategy, driven by a recorded benchmark
+# run, for predicting wall time and fork utilization at fork and host counts
+# that would take hours (or a bigger controller) to run for real.
+#
+#   ./simulate.py results.h1000.f50 --validate
+#   ./simulate.py results.h1000.f50 --forks 50,100,200 --hosts 1000,10000,50000
+#   ./simulate.py results.h1000.f50 --validate-against results.h1000.f100
+#
+# The model replays the main play of a results dir task by task. The
+# controller is a single server: for every host it waits for a free worker,
+# spends the task's dispatch cost starting it, then processes up to forks / 10
+# of the results that have arrived (linear's max_passes), each costing the
+# task's result-processing cost, and the rest once every host is queued. A
+# worker is busy from its fork until its result comes off the final queue.
+# A task ends once every result is processed, followed by the recorded gap
+# before the next task's first dispatch (lockstep bookkeeping, meta tasks,
+# includes). Everything is measured from the run's event and worker logs:
+#
+#   service time     fork -> result received, per host
+#   dispatch cost    gap between back-to-back forks while workers are free
+#   processing cost  gap between back-to-back result processing after the
+#                    last dispatch, while results are already waiting
+#   task gap         last result processed -> next task's first fork, minus
+#                    one dispatch cost
+#
+# At other host counts the recorded service times are reused round-robin.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+import argparse
+import glob
+import heapq
+import json
+import os
+import sys
+
+from collections import OrderedDict
+
+
+def median(values, default=0.0):
+    values = sorted(values)
+    if not values:
+        return default
+    return values[len(values) // 2]
+
+
+def load_recording(bdir):
+    ''' the longest play in a results dir as (meta, ordered tasks) '''
+    runs = []
+    for fn in glob.glob(os.path.join(bdir, '*_meta.json')):
+        with open(fn, 'r') as f:
+            meta = json.loads(f.read())
+        if meta.get('stop'):
+            runs.append((meta['stop'] - meta['start'], os.path.basename(fn)[:-len('_meta.json')], meta))
+    if not runs:
+        sys.exit('%s: no finished runs' % bdir)
+    wall, run_id, meta = max(runs)
+
+    forks = {}
+    fn = os.path.join(bdir, '%s_workers.ndjson' % run_id)
+    with open(fn, 'r') as f:
+        fields = json.loads(f.readline())['fields']
+        for line in f:
+            if line.strip():
+                worker = dict(zip(fields, json.loads(line)))
+                forks[(worker['host'], worker['task_uuid'])] = worker.get('fork') or worker['start']
+
+    tasks = OrderedDict()
+    with open(os.path.join(bdir, '%s_events.ndjson' % run_id), 'r') as f:
+        for line in f:
+            event = json.loads(line)
+            kind, ts = event[0], event[1]
+            if kind == 'task':
+                tasks[event[2]] = {'name': event[3], 'hosts': OrderedDict()}
+            elif kind in ('queue', 'recv', 'leave'):
+                host, task_uuid = event[2], event[3]
+                if task_uuid in tasks:
+                    tasks[task_uuid]['hosts'].setdefault(host, {})[kind] = ts
+
+    measured = []
+    for task_uuid, task in tasks.items():
+        hosts = [
+            dict(x, fork=forks.get((name, task_uuid), x.get('queue')))
+            for name, x in task['hosts'].items()
+            if 'recv' in x and 'leave' in x
+        ]
+        if not hosts:
+            continue
+        measured.append({
+            'uuid': task_uuid,
+            'name': task['name'],
+            'hosts': hosts,
+        })
+    return meta, measured
+
+
+def measure(meta, tasks):
+    ''' per-task model parameters from the recorded hosts '''
+    forks = meta['forks']
+    previous_end = meta['start']
+    for task in tasks:
+        hosts = task['hosts']
+        starts = sorted(x['fork'] for x in hosts)
+        leaves = sorted(hosts, key=lambda x: x['leave'])
+
+        # while no worker has come back yet, dispatches run back to back
+        first_recv = min(x['recv'] for x in hosts)
+        gaps = [y - x for x, y in zip(starts, starts[1:forks]) if y <= first_recv]
+        task['dispatch_cost'] = median(gaps, None)
+
+        # once everything is queued the controller only processes results,
+        # and one that was already waiting when the previous one finished
+        # is handled straight away
+        gaps = [
+            y['leave'] - x['leave'] for x, y in zip(leaves, leaves[1:])
+            if x['leave'] >= starts[-1] and y['recv'] <= x['leave']
+        ]
+        task['process_cost'] = median(gaps, None)
+
+        task['service'] = [x['recv'] - x['fork'] for x in sorted(hosts, key=lambda x: x['fork'])]
+        task['recorded'] = leaves[-1]['leave'] - previous_end
+        task['gap_before'] = starts[0] - previous_end
+        previous_end = leaves[-1]['leave']
+
+    # tasks with too few hosts to measure fall back to the run's medians
+    dispatch_cost = median([x['dispatch_cost'] for x in tasks if x['dispatch_cost'] is not None])
+    process_cost = median([x['process_cost'] for x in tasks if x['process_cost'] is not None])
+    for task in tasks:
+        if task['dispatch_cost'] is None:
+            task['dispatch_cost'] = dispatch_cost
+        if task['process_cost'] is None:
+            task['process_cost'] = process_cost
+        task['gap_before'] = max(0.0, task['gap_before'] - task['dispatch_cost'])
+    return meta['stop'] - previous_end
+
+
+def simulate_task(task, forks, hosts, start):
+    '''
+    One lockstep task from `start`: returns (end, worker busy seconds).
+    Mirrors StrategyModule.run in linear: queue a host (waiting for a free
+    worker if all are busy), then process at most forks / 10 of the results
+    that are already in, and once every host is queued process the rest.
+    '''
+    max_passes = max(1, int(forks * 0.1))
+    service = task['service']
+    dispatch_cost = task['dispatch_cost']
+    process_cost = task['process_cost']
+    clock = start
+    # completion times of running workers, and of results not yet processed
+    running = []
+    arrived = []
+    busy = 0.0
+
+    def collect(now):
+        while running and running[0] <= now:
+            heapq.heappush(arrived, heapq.heappop(running))
+
+    for n in range(hosts):
+        collect(clock)
+        if len(running) >= forks:
+            # _queue_task spins until a worker exits
+            clock = max(clock, running[0])
+            collect(clock)
+        clock += dispatch_cost
+        duration = service[n % len(service)]
+        heapq.heappush(running, clock + duration)
+        busy += duration
+        collect(clock)
+        for x in range(max_passes):
+            if not arrived:
+                break
+            heapq.heappop(arrived)
+            clock += process_cost
+            collect(clock)
+
+    # _wait_on_pending_results
+    while running or arrived:
+        if not arrived:
+            clock = max(clock, running[0])
+            collect(clock)
+        heapq.heappop(arrived)
+        clock += process_cost
+        collect(clock)
+    return clock, busy
+
+
+def simulate(tasks, tail, forks, hosts):
+    clock = 0.0
+    busy = 0.0
+    per_task = []
+    for task in tasks:
+        clock += task['gap_before']
+        start = clock
+        clock, task_busy = simulate_task(task, forks, hosts, clock)
+        busy += task_busy
+        per_task.append((task, clock - start + task['gap_before']))
+    clock += tail
+    return {
+        'wall': clock,
+        'utilization': busy / (forks * clock) if clock else 0.0,
+        'tasks': per_task,
+    }
+
+
+def print_tasks(result, recorded=None):
+    print('    %-32s %10s %10s %10s %10s' % ('task', 'predicted', 'recorded', 'dispatch', 'process'))
+    for n, (task, predicted) in enumerate(result['tasks']):
+        line = '    %-32s %10.2f %10s %9.1fms %9.1fms' % (
+            task['name'][:32],
+            predicted,
+            '-' if recorded is None else '%.2f' % recorded[n],
+            task['dispatch_cost'] * 1000,
+            task['process_cost'] * 1000
+        )
+        print(line)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('recording', help='results dir of the run to model')
+    parser.add_argument('--forks', help='comma separated fork counts (the recorded one)')
+    parser.add_argument('--hosts', help='comma separated host counts (the recorded one)')
+    parser.add_argument('--validate', action='store_true',
+                        help='replay at the recorded forks and hosts and compare with the recorded wall time')
+    parser.add_argument('--validate-against', nargs='+', default=[], metavar='DIR',
+                        help='predict other real runs of the same playbook from the recording and compare')
+    parser.add_argument('--tasks', action='store_true', help='break the prediction down per task')
+    args = parser.parse_args()
+
+    meta, tasks = load_recording(args.recording)
+    if not tasks:
+        sys.exit('%s: no worker results recorded' % args.recording)
+    tail = measure(meta, tasks)
+    recorded_wall = meta['stop'] - meta['start']
+    print('recording: %s hosts:%s forks:%s wall:%.2fs tasks:%d' % (
+        args.recording, meta['hosts'], meta['forks'], recorded_wall, len(tasks)
+    ))
+
+    if args.validate:
+        result = simulate(tasks, tail, meta['forks'], meta['hosts'])
+        print('validate: predicted %.2fs recorded %.2fs error %+.1f%% utilization %.0f%%' % (
+            result['wall'], recorded_wall, (result['wall'] - recorded_wall) / recorded_wall * 100,
+            result['utilization'] * 100
+        ))
+        if args.tasks:
+            print_tasks(result, [x['recorded'] for x in tasks])
+
+    for bdir in args.validate_against:
+        other, other_tasks = load_recording(bdir)
+        measure(other, other_tasks)
+        result = simulate(tasks, tail, other['forks'], other['hosts'])
+        other_wall = other['stop'] - other['start']
+        print('validate %s hosts:%s forks:%s: predicted %.2fs recorded %.2fs error %+.1f%% utilization %.0f%%' % (
+            bdir, other['hosts'], other['forks'], result['wall'], other_wall,
+            (result['wall'] - other_wall) / other_wall * 100, result['utilization'] * 100
+        ))
+        if args.tasks and len(other_tasks) == len(tasks):
+            print_tasks(result, [x['recorded'] for x in other_tasks])
+
+    if args.forks or args.hosts or not (args.validate or args.validate_against):
+        fork_counts = [int(x) for x in args.forks.split(',')] if args.forks else [meta['forks']]
+        host_counts = [int(x) for x in args.hosts.split(',')] if args.hosts else [meta['hosts']]
+        print('%-10s %-10s %-12s %-12s %-12s' % ('hosts', 'forks', 'wall', 'hosts/s', 'utilization'))
+        for hosts in host_counts:
+            for forks in fork_counts:
+                result = simulate(tasks, tail, forks, hosts)
+                print('%-10s %-10s %-12s %-12s %-12s' % (
+                    hosts, forks, '%.2fs' % result['wall'],
+                    '%.1f' % (hosts * len(tasks) / result['wall']),
+                    '%.0f%%' % (result['utilization'] * 100)
+                ))
+                if args.tasks:
+                    print_tasks(result)
+
+
+if __name__ == "__main__":
+    main()
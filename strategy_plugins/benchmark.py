@@ -20,127 +20,31 @@ __metaclass__ = type
 
 DOCUMENTATION = '''
     strategy: benchmark
-    short_description: Executes tasks in a linear fashion
+    short_description: Executes tasks in a linear fashion, recording benchmark results
     description:
         - Task execution is in lockstep per host batch as defined by C(serial) (default all).
           Up to the fork limit of hosts will execute each task at the same time and then
           the next series of hosts until the batch is done, before going on to the next task.
+        - Same as C(benchmark_linear), kept under its original name.
     version_added: "2.0"
     notes:
      - This was the default Ansible behaviour before 'strategy plugins' were introduced in 2.0.
     author: Ansible Core Team
 '''
 
-import json
 import os
-import shutil
-import subprocess
-import time
-
-from collections import OrderedDict
-
-from ansible.errors import AnsibleError, AnsibleAssertionError
-from ansible.executor.play_iterator import PlayIterator
-from ansible.module_utils.six import iteritems
-from ansible.module_utils._text import to_text
-from ansible.playbook.block import Block
-from ansible.playbook.included_file import IncludedFile
-from ansible.playbook.task import Task
-from ansible.plugins.loader import action_loader
-from ansible.plugins.strategy import StrategyBase
-from ansible.template import Templar
-from ansible.utils.display import Display
-
-display = Display()
+import sys
 
 from ansible.plugins.strategy.linear import StrategyModule as LinearStrategyModule
 
+# the plugin loader does not put this directory on sys.path
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
 
-class StrategyModule(LinearStrategyModule):
-
-    #br_dir = None
-    hostcount = None
-    host_queue_starts =  None
-    concurrent_hosts = None
-
-    def __init__(self, tqm):
-        super(StrategyModule, self).__init__(tqm)
-
-        #self._set_br_dir()
-
-        self.hostcount = int(os.environ.get('HOSTCOUNT', 100))
-        self.host_queue_starts = []
-        self.concurrent_hosts = []
-
-        if 'testhosts' not in self._inventory.groups:
-            display.display('adding hosts via strategy')
-
-            for x in range(0, self.hostcount):
-                host = 'host-' + str(x)
-                if host not in self._inventory.hosts:
-                    hd = {
-                        'host_name': host,
-                        'groups': ['testhosts'],
-                        'host_vars': {
-                            'ansible_python_interpreter': '/usr/bin/python3'
-                        }
-                    }
-                    self._add_host(hd, None)
-
-    @property
-    def br_dir(self):
-        brdir = os.environ.get('BENCHMARK_RESULTS', 'benchmark_results')
-        #if os.path.exists(self.br_dir):
-        #    shutil.rmtree(self.br_dir)
-        #os.mkdir(self.br_dir)
-        if not os.path.exists(brdir):
-            os.mkdir(brdir)
-        return brdir
-
-    def _queue_task(self, *args, **kwargs):
-        ts = time.time()
-        self.host_queue_starts.append({
-            'host': str(args[0]),
-            'task_uuid': args[1]._uuid,
-            'task_name': args[1].name,
-            'time': ts
-        })
-        self.concurrent_hosts.append({
-            'time': ts,
-            'task_uuid': args[1]._uuid,
-            'task_name': args[1].name,
-            'active': list(self._blocked_hosts.keys())
-        })
-        return super(StrategyModule, self)._queue_task(*args, **kwargs)
-
-    def run(self, *args, **kwargs):
-        display.display('[strategy] run')
-        #self._set_br_dir()
-
-        pslog = os.path.join(self.br_dir, 'ps.log')
-        cmd = "while true; do date +'\n#%%s.%%3N' >> %s; ps xao pid,ppid,pgid,sid,%%cpu,%%mem,cmd -w 512 >> %s; sleep .1; done;" % (pslog, pslog)
-        watcher = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-        start_time = time.time()
-        result = super(StrategyModule, self).run(*args, **kwargs)
-        stop_time = time.time()
+from benchmark_mixin import BenchmarkMixin
 
-        watcher.kill()
 
-        display.display('[strategy] writing benchmark results to %s' % self.br_dir)
-        ts = str(time.time())
-        meta = {
-            'start': start_time,
-            'stop': stop_time,
-            'forks': self._variable_manager.get_vars().get('ansible_forks', None),
-            'hosts': self.hostcount,
-            'time': ts
-        }
-        with open(os.path.join(self.br_dir, '%s_meta.json' % ts), 'w') as f:
-            f.write(json.dumps(meta, indent=2))
-        with open(os.path.join(self.br_dir, '%s_host_queue_starts.json' % ts), 'w') as f:
-            f.write(json.dumps(self.host_queue_starts, indent=2))
-        with open(os.path.join(self.br_dir, '%s_concurrent_hosts.json' % ts), 'w') as f:
-            f.write(json.dumps(self.concurrent_hosts, indent=2))
+class StrategyModule(BenchmarkMixin, LinearStrategyModule):
 
-        return result
+    strategy_name = 'linear'
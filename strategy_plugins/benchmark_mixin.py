@@ -0,0 +1,2316 @@
+# (c) 2012-2014, Michael DeHaan <michael.dehaan@gmail.com>
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+# Instrumentation shared by the benchmark_* strategies. Not a strategy plugin
+# itself: each plugin mixes BenchmarkMixin in ahead of the stock strategy it
+# wraps, so all of them write the same results.
+
+import atexit
+import errno
+import functools
+import gc
+import json
+import os
+import re
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import psutil
+
+from collections import OrderedDict, deque
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+from ansible import constants as C
+from ansible.errors import AnsibleError, AnsibleConnectionFailure
+from ansible.executor.process.worker import WorkerProcess
+from ansible.executor.task_executor import TaskExecutor
+from ansible.executor.task_result import TaskResult
+from ansible.inventory.group import Group
+from ansible.inventory.host import Host
+from ansible.inventory.manager import InventoryManager
+from ansible.module_utils.six import string_types
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.parsing.dataloader import DataLoader
+from ansible.playbook.block import Block
+from ansible.playbook.handler import Handler
+from ansible.playbook.play import Play
+from ansible.playbook.task import Task
+from ansible.plugins import loader as plugin_loader
+from ansible.plugins import strategy as strategy_base
+from ansible.template import Templar
+from ansible.utils.display import Display
+from ansible.utils.unsafe_proxy import wrap_var
+from ansible.vars.hostvars import HostVars
+from ansible.vars.manager import VariableManager
+from jinja2 import meta as jinja2_meta, nodes as jinja2_nodes
+from jinja2.exceptions import TemplateSyntaxError
+
+display = Display()
+
+
+class ProcessTreeSampler(threading.Thread):
+    '''
+    Samples the ansible-playbook process tree (the controller, its workers
+    and their ssh/sshpass children) from inside the controller, writing one
+    NDJSON line per sample. The first line is a header naming the columns.
+    '''
+
+    FIELDS = ['pid', 'ppid', 'name', 'status', 'cpu', 'rss', 'pss']
+
+    def __init__(self, path, interval=0.1, pss=False):
+        super(ProcessTreeSampler, self).__init__(name='benchmark-ps-sampler')
+        self.daemon = True
+        self.path = path
+        self.interval = interval
+        self.pss = pss
+        self.root = psutil.Process(os.getpid())
+        self._stop_event = threading.Event()
+        # pid -> cumulative user+system cpu seconds at the previous sample,
+        # primed with the controller so its startup cost is not counted
+        cpu = self.root.cpu_times()
+        self._cpu_seen = {self.root.pid: cpu.user + cpu.system}
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        with open(self.path, 'w') as f:
+            header = {
+                'fields': self.FIELDS,
+                'interval': self.interval,
+                'root': self.root.pid
+            }
+            f.write(json.dumps(header) + '\n')
+            while not self._stop_event.is_set():
+                f.write(json.dumps(self.sample(), separators=(',', ':')) + '\n')
+                f.flush()
+                self._stop_event.wait(self.interval)
+
+    def sample(self):
+        ''' [time, sample cost, [[pid, ppid, name, status, cpu delta, rss, pss], ...]] '''
+        ts = time.time()
+        try:
+            tree = [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            tree = []
+
+        procs = []
+        cpu_seen = {}
+        for proc in tree:
+            try:
+                with proc.oneshot():
+                    cpu = proc.cpu_times()
+                    cpu_total = cpu.user + cpu.system
+                    row = [
+                        proc.pid,
+                        proc.ppid(),
+                        proc.name(),
+                        proc.status(),
+                        round(cpu_total - self._cpu_seen.get(proc.pid, 0.0), 4),
+                        proc.memory_info().rss,
+                        proc.memory_full_info().pss if self.pss else None
+                    ]
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            cpu_seen[proc.pid] = cpu_total
+            procs.append(row)
+
+        # forget exited pids so the table only tracks the live tree
+        self._cpu_seen = cpu_seen
+        return [round(ts, 4), round(time.time() - ts, 6), procs]
+
+
+class EventWriter(threading.Thread):
+    '''
+    Append-only NDJSON event log. The controller only appends tuples to a
+    deque; the thread serializes and flushes them in batches, so memory stays
+    flat and a killed run still leaves everything up to the last flush.
+    Each line is a JSON array whose first element is the record type.
+    '''
+
+    def __init__(self, path, flush_interval=0.5):
+        super(EventWriter, self).__init__(name='benchmark-event-writer')
+        self.daemon = True
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._pending = deque()
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+
+    def emit(self, *record):
+        self._pending.append(record)
+
+    def flush(self, timeout=5.0):
+        '''
+        wait until everything emitted so far is on disk: the marker queues
+        behind those records and the writer sets it once they are written
+        '''
+        written = threading.Event()
+        self._pending.append(written)
+        self._wake.set()
+        written.wait(timeout)
+
+    def close(self):
+        self._stop_event.set()
+        self._wake.set()
+        self.join()
+
+    def run(self):
+        with open(self.path, 'a') as f:
+            while not self._stop_event.is_set():
+                self._wake.wait(self.flush_interval)
+                self._wake.clear()
+                self._drain(f)
+            self._drain(f)
+
+    def _drain(self, f):
+        lines = []
+        while True:
+            try:
+                record = self._pending.popleft()
+            except IndexError:
+                break
+            if isinstance(record, tuple):
+                lines.append(json.dumps(record, separators=(',', ':')))
+                continue
+            # a flush() marker
+            self._write(f, lines)
+            lines = []
+            record.set()
+        self._write(f, lines)
+
+    def _write(self, f, lines):
+        if lines:
+            f.write('\n'.join(lines) + '\n')
+            f.flush()
+            self.records += len(lines)
+
+
+class OccupancyTracker(dict):
+    '''
+    Drop-in for StrategyBase._blocked_hosts that records when hosts leave a
+    worker instead of snapshotting the whole active set on every dispatch.
+    The 'queue' event logged by _queue_task doubles as the 'enter'
+    transition, and the 'leave' is logged when result processing unblocks
+    the host.
+    '''
+
+    def __init__(self, events, *args, **kwargs):
+        super(OccupancyTracker, self).__init__(*args, **kwargs)
+        self.events = events
+        # host -> uuid of the task it is currently running
+        self.occupants = {}
+        # host -> when it last left a worker
+        self.released = {}
+        # task uuid -> hosts that finished it
+        self.completed = {}
+
+    def enter(self, host, task_uuid):
+        self.occupants[host] = task_uuid
+
+    def __delitem__(self, host):
+        super(OccupancyTracker, self).__delitem__(host)
+        task_uuid = self.occupants.pop(host, None)
+        if task_uuid is not None:
+            ts = time.time()
+            self.released[host] = ts
+            self.completed[task_uuid] = self.completed.get(task_uuid, 0) + 1
+            self.events.emit('leave', ts, host, task_uuid)
+
+
+class ResultReceiptLog(deque):
+    '''
+    Drop-in for StrategyBase._results. The results thread appends each
+    TaskResult the moment it comes off the final queue, so that is where
+    the 'recv' event is stamped. At that point _host and _task are still
+    the name and uuid the worker sent. Receipt times are also kept in
+    `received` until the strategy claims them. Per loop item and per until
+    retry results pass through here too, on their way to being skipped by
+    _process_pending_results; only the worker's final result is counted,
+    and sets `arrived`, which the autotuner waits on.
+    '''
+
+    def __init__(self, events, arrived, *args):
+        super(ResultReceiptLog, self).__init__(*args)
+        self.events = events
+        self.arrived = arrived
+        self.received = {}
+        # (host, task uuid) whose receipt nobody will claim, so it is not kept
+        self.unclaimed = set()
+        self.count = 0
+        self.last = None
+
+    def append(self, result):
+        ts = time.time()
+        # any result shows the play is moving, for the stall check
+        self.last = ts
+        data = getattr(result, '_result', None)
+        if isinstance(data, dict) and ('_ansible_item_result' in data or '_ansible_retry' in data):
+            super(ResultReceiptLog, self).append(result)
+            return
+        key = (to_text(getattr(result._host, 'name', result._host)), getattr(result._task, '_uuid', result._task))
+        if key in self.unclaimed:
+            self.unclaimed.discard(key)
+        else:
+            self.received[key] = ts
+        self.count += 1
+        self.events.emit('recv', ts, key[0], key[1])
+        super(ResultReceiptLog, self).append(result)
+        self.arrived.set()
+
+    def claim(self, key):
+        '''
+        When the result for key came off the final queue, or None if it has
+        not yet, in which case its receipt will not be kept either. Call with
+        the strategy's _results_lock held, which append() runs under.
+        '''
+        ts = self.received.pop(key, None)
+        if ts is None:
+            self.unclaimed.add(key)
+        return ts
+
+
+class MetricsServer(threading.Thread):
+    '''
+    Serves the running counters of the current play in the Prometheus text
+    format, over HTTP on a localhost port or, on a UNIX socket, written
+    straight to every client that connects. There is one server per
+    controller process; each play's strategy points it at itself, and
+    between plays it keeps serving the last play's final values.
+    benchmark_top.py renders it.
+    '''
+
+    RATE_WINDOW = 10
+
+    def __init__(self, port=None, path=None):
+        super(MetricsServer, self).__init__(name='benchmark-metrics')
+        self.daemon = True
+        self.path = path
+        self.strategy = None
+        self.root = psutil.Process(os.getpid())
+        # (time, dispatched) about once a second, for the dispatch rate
+        self._rate = deque(maxlen=self.RATE_WINDOW + 1)
+        if path:
+            if os.path.exists(path):
+                os.unlink(path)
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = path
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            address = ('127.0.0.1', port)
+        try:
+            self.sock.bind(address)
+            self.sock.listen(8)
+        except socket.error as e:
+            self.sock.close()
+            raise AnsibleError('cannot serve benchmark metrics on %s: %s' % (path or port, to_text(e)))
+        if path:
+            atexit.register(self._unlink)
+        self.sock.settimeout(1.0)
+
+    def serve(self, strategy):
+        self.strategy = strategy
+        self._rate.clear()
+
+    def run(self):
+        while True:
+            self._sample_rate()
+            try:
+                conn = self.sock.accept()[0]
+            except socket.timeout:
+                continue
+            try:
+                conn.settimeout(1.0)
+                self._respond(conn)
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+
+    def _unlink(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _respond(self, conn):
+        if self.path is None:
+            # only GET is served, whatever the path
+            request = b''
+            while b'\r\n\r\n' not in request and len(request) < 65536:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    break
+                request += chunk
+            body = to_bytes(self.render())
+            conn.sendall(
+                b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                b'Content-Length: %d\r\n\r\n' % len(body)
+            )
+            conn.sendall(body)
+        else:
+            conn.sendall(to_bytes(self.render()))
+
+    def _sample_rate(self):
+        strategy = self.strategy
+        if strategy is None:
+            return
+        ts = time.time()
+        if not self._rate or ts - self._rate[-1][0] >= 1.0:
+            self._rate.append((ts, strategy._dispatched))
+
+    def dispatch_rate(self):
+        if len(self._rate) < 2:
+            return 0.0
+        (t0, d0), (t1, d1) = self._rate[0], self._rate[-1]
+        return (d1 - d0) / (t1 - t0)
+
+    def render(self):
+        strategy = self.strategy
+        lines = []
+
+        def metric(name, mtype, text, samples):
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s %s' % (name, mtype))
+            for labels, value in samples:
+                if labels:
+                    labels = '{%s}' % ','.join('%s="%s"' % (k, _label_value(v)) for k, v in labels)
+                lines.append('%s%s %s' % (name, labels or '', value))
+
+        cpu = self.root.cpu_times()
+        metric('process_cpu_seconds_total', 'counter', 'Controller user and system CPU time.',
+               [(None, cpu.user + cpu.system)])
+        metric('process_resident_memory_bytes', 'gauge', 'Controller resident memory.',
+               [(None, self.root.memory_info().rss)])
+
+        if strategy is None or strategy.events is None:
+            return '\n'.join(lines) + '\n'
+
+        results = strategy._results
+        handler_results = strategy._handler_results
+        last_results = [x for x in (results.last, handler_results.last) if x is not None]
+        completed = strategy._blocked_hosts.completed
+        metric('benchmark_info', 'gauge', 'The play being served.', [(
+            [('run_id', strategy.run_id), ('strategy', strategy.strategy_name), ('pid', os.getpid())], 1
+        )])
+        metric('benchmark_hosts', 'gauge', 'Synthetic hosts in the inventory.', [(None, strategy.hostcount)])
+        metric('benchmark_forks', 'gauge', 'Worker slots.', [(None, len(strategy._workers))])
+        metric('benchmark_forks_busy', 'gauge', 'Workers started whose result has not been received yet.',
+               [(None, strategy._in_flight())])
+        if strategy.autotuner is not None:
+            metric('benchmark_concurrency_limit', 'gauge', 'Workers the autotuner currently allows.',
+                   [(None, strategy.autotuner.limit)])
+        metric('benchmark_dispatched_total', 'counter', 'Tasks handed to workers.', [(None, strategy._dispatched)])
+        metric('benchmark_completed_total', 'counter', 'Task results processed.', [(None, sum(completed.values()))])
+        metric('benchmark_dispatch_rate', 'gauge', 'Dispatches per second over the last %ss.' % self.RATE_WINDOW,
+               [(None, round(self.dispatch_rate(), 3))])
+        metric('benchmark_result_backlog', 'gauge', 'Results received but not yet processed by the strategy.',
+               [(None, len(results) + len(handler_results))])
+        metric('benchmark_pending_results', 'gauge', 'Dispatched tasks whose result has not been processed.',
+               [(None, strategy._pending_results)])
+        metric('benchmark_last_dispatch_timestamp_seconds', 'gauge', 'When a task was last handed to a worker.',
+               [(None, strategy._last_dispatch or 0)])
+        metric('benchmark_last_result_timestamp_seconds', 'gauge', 'When a result was last received.',
+               [(None, max(last_results) if last_results else 0)])
+
+        tasks = list(strategy._tasks_seen.items())
+        metric('benchmark_task_dispatched_total', 'counter', 'Hosts handed each task.', [
+            ([('task_uuid', uuid), ('task', name)], strategy._task_dispatched.get(uuid, 0)) for uuid, name in tasks
+        ])
+        metric('benchmark_task_completed_total', 'counter', 'Hosts that finished each task.', [
+            ([('task_uuid', uuid), ('task', name)], completed.get(uuid, 0)) for uuid, name in tasks
+        ])
+        return '\n'.join(lines) + '\n'
+
+
+def _label_value(value):
+    return to_text(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+METRICS_SERVER = None
+
+
+def metrics_server(port=0, path=None):
+    ''' the process wide MetricsServer, started on first use if it is configured '''
+    global METRICS_SERVER
+    if METRICS_SERVER is None:
+        if not path and not port:
+            return None
+        METRICS_SERVER = MetricsServer(port=port, path=path)
+        METRICS_SERVER.start()
+    return METRICS_SERVER
+
+
+class BenchmarkWorkerProcess(WorkerProcess):
+    '''
+    WorkerProcess that times itself from inside the child and appends one
+    line to record_path when it is done. Lines are small and written with a
+    single O_APPEND write so concurrent workers do not interleave.
+
+    Besides the timings, each line carries what the fork cost the child:
+    the controller's RSS it started out sharing, the page faults it took
+    (mostly copy-on-write after the fork), its CPU time, and its PSS and
+    private dirty memory at exit. These come from /proc and are None
+    elsewhere.
+    '''
+
+    FIELDS = [
+        'pid', 'host', 'task_uuid', 'start', 'end',
+        'fork', 'rss_at_fork', 'minflt', 'majflt', 'utime', 'stime', 'pss', 'private_dirty',
+        'cpu', 'migrations', 'vcsw', 'ivcsw'
+    ]
+    record_path = None
+    # CpuPlacement of the current play, if workers are pinned
+    placement = None
+    fork_time = None
+    cpu = None
+    # parent side seconds spent in start(), mostly the fork itself
+    fork_cost = None
+    # workers started by the current play
+    started = 0
+
+    def start(self):
+        # parent side, the moment the worker slot is taken
+        self.fork_time = time.time()
+        BenchmarkWorkerProcess.started += 1
+        if self.placement is not None:
+            self.cpu = self.placement.next_worker_cpu()
+        try:
+            return super(BenchmarkWorkerProcess, self).start()
+        finally:
+            self.fork_cost = time.time() - self.fork_time
+
+    def run(self):
+        start = time.time()
+        if self.cpu is not None:
+            os.sched_setaffinity(0, [self.cpu])
+        rss_at_fork = self._read_rss()
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            # inherited from a controller running with BENCHMARK_TRACEMALLOC
+            tracemalloc.stop()
+        try:
+            return super(BenchmarkWorkerProcess, self).run()
+        finally:
+            if self.record_path:
+                end = time.time()
+                self._write_record([
+                    os.getpid(),
+                    self._host.name,
+                    self._task._uuid,
+                    start,
+                    end,
+                    self.fork_time,
+                    rss_at_fork
+                ] + self._read_stat() + self._read_smaps_rollup() + [self.cpu] + self._read_sched())
+
+    @staticmethod
+    def _read_rss():
+        try:
+            with open('/proc/self/statm', 'r') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (IOError, OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _read_stat():
+        ''' [minflt, majflt, utime, stime] from /proc/self/stat '''
+        try:
+            with open('/proc/self/stat', 'r') as f:
+                # the command name can contain spaces, fields resume after it
+                fields = f.read().rsplit(')', 1)[1].split()
+            ticks = float(os.sysconf('SC_CLK_TCK'))
+            return [int(fields[7]), int(fields[9]), int(fields[11]) / ticks, int(fields[12]) / ticks]
+        except (IOError, OSError, ValueError, IndexError):
+            return [None, None, None, None]
+
+    @staticmethod
+    def _read_smaps_rollup():
+        ''' [pss, private dirty] in bytes from /proc/self/smaps_rollup (linux 4.14+) '''
+        values = {}
+        try:
+            with open('/proc/self/smaps_rollup', 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    if fields[0] in ('Pss:', 'Private_Dirty:'):
+                        values[fields[0]] = int(fields[1]) * 1024
+        except (IOError, OSError, ValueError, IndexError):
+            pass
+        return [values.get('Pss:'), values.get('Private_Dirty:')]
+
+    @staticmethod
+    def _read_sched():
+        ''' [migrations, voluntary, involuntary context switches] from /proc/self/sched '''
+        sched = read_sched('/proc/self/sched')
+        return [sched.get('se.nr_migrations'), sched.get('nr_voluntary_switches'), sched.get('nr_involuntary_switches')]
+
+    def _write_record(self, record):
+        try:
+            fd = os.open(self.record_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, to_bytes(json.dumps(record, separators=(',', ':')) + '\n'))
+            finally:
+                os.close(fd)
+        except (IOError, OSError):
+            pass
+
+
+SCHED_FIELDS = ('se.nr_migrations', 'nr_voluntary_switches', 'nr_involuntary_switches')
+
+
+def read_sched(path):
+    ''' the migration and context switch counters of a /proc/<pid>/sched file, {} without CONFIG_SCHED_DEBUG '''
+    counters = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                name, sep, value = line.partition(':')
+                name = name.strip()
+                if sep and name in SCHED_FIELDS:
+                    counters[name] = int(float(value))
+    except (IOError, OSError, ValueError):
+        pass
+    return counters
+
+
+def parse_cpus(spec):
+    ''' '0-3,8' -> [0, 1, 2, 3, 8] '''
+    cpus = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        try:
+            cpus.update(range(int(first), int(last or first) + 1))
+        except ValueError:
+            raise AnsibleError('bad CPU list %r, expected e.g. 0-3,8' % spec)
+    return sorted(cpus)
+
+
+def env_number(name, default, convert=float, minimum=None):
+    ''' a numeric environment knob, or an AnsibleError naming it '''
+    value = os.environ.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        number = convert(value)
+    except ValueError:
+        raise AnsibleError('%s must be a number, not %r' % (name, value))
+    if minimum is not None and number < minimum:
+        raise AnsibleError('%s must be at least %s, not %r' % (name, minimum, value))
+    return number
+
+
+class CpuPlacement(object):
+    '''
+    Pins every controller thread (the strategy loop, the results thread and
+    the benchmark threads) to the controller CPUs, and hands each worker the
+    next of the worker CPUs round-robin as it is started. The worker pins
+    itself right after the fork. The worker CPUs default to the allowed CPUs
+    the controller is not using. The controller's migration and context
+    switch counts over the play are recorded whether or not anything is
+    pinned, so pinned runs have a baseline to compare against.
+    '''
+
+    def __init__(self, controller=None, workers=None):
+        allowed = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+        if (controller or workers) and allowed is None:
+            raise AnsibleError('CPU pinning needs os.sched_setaffinity (python 3 on linux)')
+        for name, cpus in (('BENCHMARK_CONTROLLER_CPU', controller), ('BENCHMARK_WORKER_CPUS', workers)):
+            outside = [x for x in cpus or [] if x not in allowed]
+            if outside:
+                raise AnsibleError('%s has CPUs %s outside the ones this process may run on (%s)' % (
+                    name, ','.join(str(x) for x in outside), ','.join(str(x) for x in allowed)))
+        self.controller = controller
+        self.workers = workers
+        if controller and not workers:
+            self.workers = [x for x in allowed if x not in controller]
+            if not self.workers:
+                display.warning('no CPUs left for workers besides the controller\'s %s, workers are not pinned' % controller)
+                self.workers = None
+        self._next = 0
+        self._old = {}
+        self._before = None
+
+    def start(self):
+        if self.controller:
+            for tid in self._threads():
+                try:
+                    old = os.sched_getaffinity(tid)
+                    os.sched_setaffinity(tid, self.controller)
+                except OSError as e:
+                    if e.errno == errno.ESRCH:
+                        # the thread exited
+                        continue
+                    self._restore()
+                    raise AnsibleError('cannot pin controller thread %s to CPUs %s: %s' % (
+                        tid, ','.join(str(x) for x in self.controller), to_text(e)))
+                self._old[tid] = old
+        self._before = self._counters()
+
+    def next_worker_cpu(self):
+        if not self.workers:
+            return None
+        cpu = self.workers[self._next % len(self.workers)]
+        self._next += 1
+        return cpu
+
+    def stop(self):
+        after = self._counters()
+        self._restore()
+        deltas = dict((x, after[x] - self._before.get(x, 0)) for x in after)
+        return {
+            'controller_cpus': self.controller,
+            'worker_cpus': self.workers,
+            'migrations': deltas.get('se.nr_migrations'),
+            'voluntary_switches': deltas.get('nr_voluntary_switches'),
+            'involuntary_switches': deltas.get('nr_involuntary_switches'),
+        }
+
+    def _restore(self):
+        if self._old:
+            # threads started during the play inherited the main thread's pinning
+            main = self._old.get(os.getpid())
+            for tid in self._threads():
+                try:
+                    os.sched_setaffinity(tid, self._old.get(tid, main))
+                except (OSError, TypeError):
+                    continue
+            self._old = {}
+
+    @staticmethod
+    def _threads():
+        try:
+            return [int(x) for x in os.listdir('/proc/self/task')]
+        except OSError:
+            return [0]
+
+    def _counters(self):
+        ''' sched counters summed over the controller's live threads '''
+        totals = {}
+        for tid in self._threads():
+            for name, value in read_sched('/proc/self/task/%s/sched' % tid).items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+
+class LogHistogram(object):
+    '''
+    HDR-style histogram. Values are recorded as integers (seconds become
+    microseconds with the default scale) into power-of-two ranges that are
+    each split into 16 linear buckets, so the relative error stays under ~6%
+    at any magnitude while only the occupied buckets are stored.
+    '''
+
+    SIG_BITS = 5
+
+    def __init__(self, scale=1000000):
+        self.scale = scale
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value):
+        ''' lower bound and width, in scaled units, of the bucket holding value '''
+        scaled = max(0, int(value * self.scale))
+        width = self.width(scaled)
+        return scaled // width * width, width
+
+    def width(self, scaled):
+        ''' width of the bucket holding a scaled value, or starting at it '''
+        return 1 << max(0, int(scaled).bit_length() - self.SIG_BITS)
+
+    def record(self, value):
+        lower = self.bucket(value)[0]
+        self.buckets[lower] = self.buckets.get(lower, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, pct):
+        if not self.count:
+            return None
+        target = self.count * pct / 100.0
+        seen = 0
+        for lower in sorted(self.buckets):
+            seen += self.buckets[lower]
+            if seen >= target:
+                width = self.width(lower)
+                # the bucket's midpoint can lie past the values actually seen in it
+                return min(max((lower + (width - 1) / 2.0) / self.scale, self.min), self.max)
+        return self.max
+
+    def merge(self, other):
+        for lower, count in other.buckets.items():
+            self.buckets[lower] = self.buckets.get(lower, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'scale': self.scale,
+            'buckets': sorted(self.buckets.items())
+        }
+
+
+class PhaseProfiler(object):
+    '''
+    Charges controller main-thread time to scheduling phases by wrapping the
+    methods that implement them. Phases nest (queueing a task templates,
+    processing results sends callbacks), and time is charged to the
+    innermost phase only, so the phase totals add up to the profiled time.
+    Each call's inclusive latency goes into a per-task LogHistogram.
+    '''
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.thread = threading.current_thread()
+        self.task = None
+        self.task_names = OrderedDict([(None, '(play start)')])
+        # task uuid -> phase -> [exclusive wall, exclusive cpu, LogHistogram]
+        self.tasks = OrderedDict()
+        self._stack = []
+        self._patched = []
+        self._cpu_clock = getattr(time, 'thread_time', time.clock if hasattr(time, 'clock') else time.time)
+
+    def set_task(self, task):
+        if task._uuid != self.task:
+            self.task = task._uuid
+            self.task_names.setdefault(task._uuid, task.get_name())
+
+    def wrap(self, obj, attr, phase):
+        had_attr = attr in vars(obj)
+        orig_attr = vars(obj).get(attr)
+        orig = getattr(obj, attr)
+        profiler = self
+
+        @functools.wraps(orig)
+        def timed(*args, **kwargs):
+            if os.getpid() != profiler.pid or threading.current_thread() is not profiler.thread:
+                return orig(*args, **kwargs)
+            if profiler._stack and profiler._stack[-1][0] == phase:
+                return orig(*args, **kwargs)
+            profiler._enter(phase)
+            try:
+                return orig(*args, **kwargs)
+            finally:
+                profiler._exit()
+
+        setattr(obj, attr, timed)
+        self._patched.append((obj, attr, had_attr, orig_attr))
+
+    def restore(self):
+        for obj, attr, had_attr, orig_attr in reversed(self._patched):
+            if had_attr:
+                setattr(obj, attr, orig_attr)
+            else:
+                delattr(obj, attr)
+        self._patched = []
+
+    def _enter(self, phase):
+        # [phase, wall start, cpu start, wall spent in children, cpu spent in children]
+        self._stack.append([phase, time.time(), self._cpu_clock(), 0.0, 0.0])
+
+    def _exit(self):
+        phase, wall_start, cpu_start, child_wall, child_cpu = self._stack.pop()
+        wall = time.time() - wall_start
+        cpu = self._cpu_clock() - cpu_start
+        if self._stack:
+            self._stack[-1][3] += wall
+            self._stack[-1][4] += cpu
+        phases = self.tasks.setdefault(self.task, {})
+        if phase not in phases:
+            phases[phase] = [0.0, 0.0, LogHistogram()]
+        phases[phase][0] += wall - child_wall
+        phases[phase][1] += cpu - child_cpu
+        phases[phase][2].record(wall)
+
+    def to_dict(self, wall):
+        totals = {}
+        tasks = []
+        for task_uuid, phases in self.tasks.items():
+            tphases = {}
+            for phase, (excl, cpu, hist) in phases.items():
+                tphases[phase] = {'seconds': excl, 'cpu': cpu, 'calls': hist.to_dict()}
+                total = totals.setdefault(phase, {'seconds': 0.0, 'cpu': 0.0, 'calls': 0})
+                total['seconds'] += excl
+                total['cpu'] += cpu
+                total['calls'] += hist.count
+            tasks.append({
+                'task_uuid': task_uuid,
+                'task_name': self.task_names.get(task_uuid),
+                'phases': tphases
+            })
+        profiled = sum(x['seconds'] for x in totals.values())
+        totals['other'] = {'seconds': max(0.0, wall - profiled), 'cpu': None, 'calls': None}
+        return {'wall': wall, 'phases': totals, 'tasks': tasks}
+
+
+class StackSampler(object):
+    '''
+    Samples the controller main thread's Python stack from an interval timer
+    signal and counts folded stacks per task, for flamegraphs without the
+    per-call overhead of cProfile. The 'cpu' clock (ITIMER_PROF) ticks on
+    process CPU time, which includes the results and writer threads; ticks
+    where the main thread itself barely ran are counted as '(other threads)'.
+    The 'wall' clock (ITIMER_REAL) also samples the main thread while it
+    waits. Interval timers are not inherited across fork, so workers are
+    never sampled.
+    '''
+
+    MAX_DEPTH = 128
+    CLOCKS = {
+        'cpu': (signal.SIGPROF, signal.ITIMER_PROF),
+        'wall': (signal.SIGALRM, signal.ITIMER_REAL),
+    }
+
+    def __init__(self, hz=100, clock='cpu'):
+        if clock not in self.CLOCKS:
+            raise AnsibleError('unknown stack sampler clock %r, expected one of %s' % (clock, ', '.join(self.CLOCKS)))
+        self.interval = 1.0 / hz
+        self.clock = clock
+        self.task = None
+        self.task_names = OrderedDict([(None, '(play start)')])
+        # task uuid -> folded stack -> samples
+        self.stacks = OrderedDict()
+        self.samples = 0
+        self._thread_time = getattr(time, 'thread_time', None)
+        self._last_cpu = None
+        self._prev_handler = None
+
+    def set_task(self, task):
+        if task._uuid != self.task:
+            self.task = task._uuid
+            self.task_names.setdefault(task._uuid, task.get_name())
+
+    def start(self):
+        signum, timer = self.CLOCKS[self.clock]
+        self._prev_handler = signal.signal(signum, self._sample)
+        signal.setitimer(timer, self.interval, self.interval)
+
+    def stop(self):
+        signum, timer = self.CLOCKS[self.clock]
+        signal.setitimer(timer, 0)
+        signal.signal(signum, self._prev_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        stack = None
+        if self.clock == 'cpu' and self._thread_time is not None:
+            cpu = self._thread_time()
+            if self._last_cpu is not None and cpu - self._last_cpu < self.interval / 2:
+                stack = '(other threads)'
+            self._last_cpu = cpu
+        if stack is None:
+            frames = []
+            while frame is not None and len(frames) < self.MAX_DEPTH:
+                code = frame.f_code
+                frames.append('%s (%s:%d)' % (
+                    code.co_name, '/'.join(code.co_filename.split(os.sep)[-2:]), code.co_firstlineno
+                ))
+                frame = frame.f_back
+            stack = ';'.join(reversed(frames))
+        stacks = self.stacks.setdefault(self.task, {})
+        stacks[stack] = stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def write(self, path):
+        '''
+        One <n>_<task name>.folded per task, an all.folded with the task
+        name as the root frame, and an index.json listing them.
+        '''
+        os.mkdir(path)
+        index = []
+        with open(os.path.join(path, 'all.folded'), 'w') as combined:
+            for n, (task_uuid, stacks) in enumerate(self.stacks.items()):
+                name = self.task_names.get(task_uuid) or task_uuid
+                fn = '%03d_%s.folded' % (n, re.sub(r'[^A-Za-z0-9_.-]+', '_', name)[:64])
+                with open(os.path.join(path, fn), 'w') as f:
+                    for stack, count in sorted(stacks.items()):
+                        f.write('%s %d\n' % (stack, count))
+                        combined.write('%s;%s %d\n' % (name.replace(';', ':'), stack, count))
+                index.append({
+                    'task_uuid': task_uuid,
+                    'task_name': name,
+                    'file': fn,
+                    'samples': sum(stacks.values())
+                })
+        with open(os.path.join(path, 'index.json'), 'w') as f:
+            f.write(json.dumps({
+                'clock': self.clock,
+                'interval': self.interval,
+                'samples': self.samples,
+                'tasks': index
+            }, indent=2))
+
+
+class AllocationTracker(object):
+    '''
+    Snapshots tracemalloc each time the play moves on to a new task and
+    writes what grew since the previous one to an NDJSON file, one line per
+    task: the top allocation sites by line and by file, growth summed per
+    ansible package (executor, vars, plugins/callback, ...), and the traced,
+    peak and RSS sizes that make up the retained-memory series.
+    '''
+
+    IGNORE = frozenset([
+        getattr(tracemalloc, '__file__', None),
+        '<frozen importlib._bootstrap>',
+        '<unknown>',
+    ])
+
+    def __init__(self, path, frames=1, top=20):
+        self.path = path
+        self.frames = frames
+        self.top = top
+        self.task = None
+        self.task_name = '(play start)'
+        self.snapshots = 0
+        self.root = psutil.Process(os.getpid())
+        self._sites = None
+        self._file = None
+
+    def start(self):
+        tracemalloc.start(self.frames)
+        self._file = open(self.path, 'w')
+        self._file.write(json.dumps({'frames': self.frames, 'top': self.top}) + '\n')
+        self._sites = self._take()
+
+    def stop(self):
+        self._record()
+        self._sites = None
+        tracemalloc.stop()
+        self._file.close()
+
+    def boundary(self, task):
+        ''' charge everything since the last boundary to the previous task '''
+        self._record()
+        self.task = task._uuid
+        self.task_name = task.get_name()
+
+    def _take(self):
+        '''
+        (filename, lineno) -> [size, count]. Only these totals are kept
+        between boundaries; Snapshot.compare_to would regroup both full
+        snapshots on every call, which takes seconds once the controller
+        holds a few hundred thousand live blocks.
+        '''
+        sites = {}
+        for stat in tracemalloc.take_snapshot().statistics('lineno'):
+            frame = stat.traceback[0]
+            if frame.filename in self.IGNORE:
+                continue
+            sites[(frame.filename, frame.lineno)] = [stat.size, stat.count]
+        return sites
+
+    def _record(self):
+        ts = time.time()
+        sites = self._take()
+        traced, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        # [site, size diff, count diff, size], grown sites only
+        by_lineno = []
+        by_file = {}
+        for site, (size, count) in sites.items():
+            old_size, old_count = self._sites.get(site, (0, 0))
+            if size <= old_size:
+                continue
+            by_lineno.append(['%s:%s' % site, size - old_size, count - old_count, size])
+            grown = by_file.setdefault(site[0], [site[0], 0, 0, 0])
+            grown[1] += size - old_size
+            grown[2] += count - old_count
+            grown[3] += size
+        by_lineno.sort(key=lambda x: -x[1])
+        by_file = sorted(by_file.values(), key=lambda x: -x[1])
+        by_package = {}
+        for filename, size_diff, count_diff, size in by_file:
+            package = self._package(filename)
+            by_package[package] = by_package.get(package, 0) + size_diff
+        self._sites = sites
+        self.snapshots += 1
+
+        record = {
+            'ts': ts,
+            'cost': round(time.time() - ts, 6),
+            'task_uuid': self.task,
+            'task_name': self.task_name,
+            'traced': traced,
+            'peak': peak,
+            'rss': self.root.memory_info().rss,
+            'growth': sum(x[1] for x in by_file),
+            'top_lineno': by_lineno[:self.top],
+            'top_file': by_file[:self.top],
+            'by_package': sorted(by_package.items(), key=lambda x: -x[1]),
+        }
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+
+    @staticmethod
+    def _package(filename):
+        ''' ansible/executor/play_iterator.py -> ansible/executor, anything else by directory '''
+        parts = filename.split(os.sep)
+        if 'ansible' in parts:
+            parts = parts[len(parts) - parts[::-1].index('ansible') - 1:-1]
+            return '/'.join(parts[:3] if parts[1:2] == ['plugins'] else parts[:2])
+        return os.path.dirname(filename)
+
+
+class GcTuner(object):
+    '''
+    Keeps the cyclic GC from dirtying the controller heap in every worker.
+    A fork shares the controller's pages copy-on-write, and the first
+    collection in the child writes to the GC header of every object it
+    walks. gc.freeze() (python 3.7+) moves everything alive into a
+    permanent generation that collections skip. With freeze 'play' that
+    happens once when the play starts; with 'task' it happens again each
+    time a new task is first dispatched, which also freezes the results
+    and facts the previous task left behind. The threshold, if given,
+    replaces gc.set_threshold for the play. Both are undone at the end.
+    '''
+
+    def __init__(self, freeze=None, threshold=None):
+        self.freeze = freeze
+        self.threshold = threshold
+        self.freezes = 0
+        self.seconds = 0.0
+        self._old_threshold = None
+        self._old_stats = None
+
+    def start(self):
+        self._old_stats = gc.get_stats() if hasattr(gc, 'get_stats') else None
+        if self.threshold:
+            self._old_threshold = gc.get_threshold()
+            gc.set_threshold(*self.threshold)
+        if self.freeze:
+            self._freeze()
+
+    def boundary(self):
+        if self.freeze == 'task':
+            self._freeze()
+
+    def stop(self):
+        frozen = gc.get_freeze_count() if self.freeze else None
+        if self.freeze:
+            gc.unfreeze()
+        if self._old_threshold is not None:
+            gc.set_threshold(*self._old_threshold)
+        collections = None
+        if self._old_stats is not None:
+            collections = [x['collections'] - y['collections'] for x, y in zip(gc.get_stats(), self._old_stats)]
+        return {
+            'freeze': self.freeze,
+            'threshold': list(self.threshold) if self.threshold else list(gc.get_threshold()),
+            'freezes': self.freezes,
+            'frozen': frozen,
+            'seconds': self.seconds,
+            'collections': collections,
+        }
+
+    def _freeze(self):
+        start = time.time()
+        gc.collect()
+        gc.freeze()
+        self.seconds += time.time() - start
+        self.freezes += 1
+
+
+class ForkAutotuner(threading.Thread):
+    '''
+    Hill-climbs the number of workers the strategy may have running at once,
+    between 1 and --forks. Every interval it compares the completed-host
+    throughput with the previous interval's: while throughput improves it
+    keeps moving the limit the same way, when it drops it turns around, and
+    when it stays flat it turns around with half the step, so the limit
+    settles around the knee. A controller using more than `cpu_limit` of a
+    core is saturated and always backs off. Intervals where the limit never
+    held a dispatch back say nothing about it and are skipped. Every
+    decision goes to the event log as an 'autotune' record.
+    '''
+
+    def __init__(self, strategy, ceiling, start=None, step=None, interval=2.0, cpu_limit=0.9, tolerance=0.05):
+        super(ForkAutotuner, self).__init__(name='benchmark-autotuner')
+        self.daemon = True
+        self.strategy = strategy
+        self.ceiling = ceiling
+        self.limit = max(1, min(ceiling, start or max(1, ceiling // 10)))
+        self.start_limit = self.limit
+        self.step = max(1, step or max(1, ceiling // 10))
+        self.interval = interval
+        self.cpu_limit = cpu_limit
+        self.tolerance = tolerance
+        self.direction = 1
+        self.decisions = 0
+        # dispatches that had to wait for the limit, bumped by the strategy
+        self.throttled = 0
+        self.best = (0.0, self.limit)
+        # limit -> seconds it was in force
+        self.limit_seconds = {}
+        self.root = psutil.Process(os.getpid())
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def run(self):
+        last_ts = time.time()
+        last_completed = self._completed()
+        last_cpu = self._cpu()
+        last_throttled = self.throttled
+        previous = None
+        while not self._stop_event.wait(self.interval):
+            ts = time.time()
+            completed = self._completed()
+            cpu = self._cpu()
+            elapsed = ts - last_ts
+            throughput = (completed - last_completed) / elapsed
+            cpu_used = (cpu - last_cpu) / elapsed
+            throttled = self.throttled - last_throttled
+            self.limit_seconds[self.limit] = self.limit_seconds.get(self.limit, 0.0) + elapsed
+            last_ts, last_completed, last_cpu, last_throttled = ts, completed, cpu, self.throttled
+
+            old = self.limit
+            if cpu_used >= self.cpu_limit:
+                decision = 'cpu-saturated'
+                self.direction = -1
+            elif not throttled:
+                decision = 'unconstrained'
+            elif previous is None or throughput > previous * (1 + self.tolerance):
+                decision = 'improved'
+            elif throughput < previous * (1 - self.tolerance):
+                decision = 'worse'
+                self.direction = -self.direction
+            else:
+                decision = 'flat'
+                self.direction = -self.direction
+                self.step = max(1, self.step // 2)
+
+            if decision != 'unconstrained':
+                if throughput > self.best[0]:
+                    self.best = (throughput, old)
+                self.limit = max(1, min(self.ceiling, old + self.direction * self.step))
+                previous = throughput
+            self.decisions += 1
+            self.strategy.events.emit(
+                'autotune', ts, old, self.limit, round(throughput, 3), round(cpu_used, 3), throttled, decision
+            )
+
+    def _completed(self):
+        return sum(self.strategy._blocked_hosts.completed.values())
+
+    def _cpu(self):
+        cpu = self.root.cpu_times()
+        return cpu.user + cpu.system
+
+    def to_dict(self):
+        return {
+            'start': self.start_limit,
+            'ceiling': self.ceiling,
+            'final': self.limit,
+            'best_limit': self.best[1],
+            'best_throughput': self.best[0],
+            'decisions': self.decisions,
+            'limit_seconds': sorted(self.limit_seconds.items()),
+        }
+
+
+def cgroup_memory():
+    '''
+    (version, usage path, limit path) for the memory cgroup this process is
+    in, or None. Inside a container the cgroup path in /proc/self/cgroup may
+    not exist under the mount, in which case the mount root is the cgroup.
+    '''
+    try:
+        with open('/proc/self/cgroup', 'r') as f:
+            lines = f.read().splitlines()
+    except (IOError, OSError):
+        return None
+    candidates = []
+    for line in lines:
+        parts = line.split(':', 2)
+        if len(parts) != 3:
+            continue
+        hierarchy, controllers, path = parts
+        if hierarchy == '0' and not controllers:
+            candidates.append(('v2', '/sys/fs/cgroup', path, 'memory.current', 'memory.max'))
+        elif 'memory' in controllers.split(','):
+            candidates.insert(0, ('v1', '/sys/fs/cgroup/memory', path, 'memory.usage_in_bytes', 'memory.limit_in_bytes'))
+    for version, mount, path, usage, limit in candidates:
+        for base in (mount + path.rstrip('/'), mount):
+            if os.path.exists(os.path.join(base, usage)):
+                return version, os.path.join(base, usage), os.path.join(base, limit)
+    return None
+
+
+def deep_sizeof(obj, stop=()):
+    '''
+    Bytes reachable from obj through containers, instance dicts and slots,
+    each object counted once. Instances of the `stop` types are neither
+    counted nor followed, which keeps a walk from a task or its vars from
+    taking in the whole inventory through the loader or variable manager.
+    '''
+    seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, stop):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj, 0)
+        if isinstance(obj, dict):
+            stack.extend(list(obj.keys()))
+            stack.extend(list(obj.values()))
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(list(obj))
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for name in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, name):
+                stack.append(getattr(obj, name))
+    return size
+
+
+def sampled_sizeof(container, items, stop=(), sample=100):
+    '''
+    Estimated deep size of a container with many similar items: its own
+    size plus the deep size of up to `sample` items spread evenly over
+    `items`, scaled up to their count. The walk only ever holds the sample,
+    however big the container is; whatever the items share is counted once
+    per sample rather than once, so it is somewhat overestimated.
+    '''
+    size = sys.getsizeof(container, 0)
+    items = list(items)
+    if not items:
+        return size
+    picked = items[::max(1, len(items) // sample)][:sample]
+    total = deep_sizeof(picked, stop=stop) - sys.getsizeof(picked, 0)
+    return size + int(total * len(items) / len(picked))
+
+
+class MemoryWatchdog(threading.Thread):
+    '''
+    Watches memory against the controller's cgroup limit (memory.max or
+    memory.limit_in_bytes), or against the machine's RAM when there is none,
+    so the runs big enough to be OOM killed still leave data behind. Every
+    interval it logs a 'memory' event with the controller's RSS and the
+    cgroup's usage and limit. The first time usage crosses threshold x limit
+    it calls strategy._memory_pressure() to flush everything and snapshot
+    what is holding the memory, and with abort set it then asks the TQM to
+    stop, so the play ends cleanly instead of being SIGKILLed.
+    '''
+
+    def __init__(self, strategy, threshold=0.9, interval=1.0, abort=False, top=20):
+        super(MemoryWatchdog, self).__init__(name='benchmark-memory-watchdog')
+        self.daemon = True
+        self.strategy = strategy
+        self.threshold = threshold
+        self.interval = interval
+        self.abort = abort
+        # allocation sites written to the snapshot
+        self.top = top
+        self.cgroup = cgroup_memory()
+        self.root = psutil.Process(os.getpid())
+        self.source = None
+        self.limit = None
+        self.peak_usage = 0
+        self.peak_rss = 0
+        self.triggered = None
+        self.aborted = False
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    @staticmethod
+    def _read_int(path):
+        with open(path, 'r') as f:
+            value = f.read().strip()
+        # v2 says max, v1 a page-rounded 2**63
+        if value == 'max' or int(value) >= 1 << 60:
+            return None
+        return int(value)
+
+    def sample(self):
+        ''' (controller rss, usage, limit) '''
+        rss = self.root.memory_info().rss
+        usage = limit = None
+        if self.cgroup is not None:
+            try:
+                usage = self._read_int(self.cgroup[1])
+                limit = self._read_int(self.cgroup[2])
+            except (IOError, OSError, ValueError):
+                usage = limit = None
+        if limit is not None:
+            self.source = 'cgroup %s' % self.cgroup[0]
+        else:
+            memory = psutil.virtual_memory()
+            self.source = 'system'
+            usage, limit = memory.total - memory.available, memory.total
+        return rss, usage, limit
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            ts = time.time()
+            rss, usage, limit = self.sample()
+            self.limit = limit
+            self.peak_usage = max(self.peak_usage, usage)
+            self.peak_rss = max(self.peak_rss, rss)
+            self.strategy.events.emit('memory', ts, rss, usage, limit)
+            if self.triggered is None and usage >= limit * self.threshold:
+                self.triggered = ts
+                display.warning('[strategy] memory at %.0f%% of the %s limit (%d MB), saving benchmark data' % (
+                    usage / limit * 100, self.source, limit // (1024 * 1024)
+                ))
+                try:
+                    self.strategy._memory_pressure(self, rss, usage, limit)
+                except Exception:
+                    display.warning('[strategy] memory snapshot failed: %s' % traceback.format_exc())
+                if self.abort:
+                    display.warning('[strategy] stopping the run (BENCHMARK_MEMORY_ABORT)')
+                    self.aborted = True
+                    self.strategy._tqm._terminated = True
+
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'limit': self.limit,
+            'threshold': self.threshold,
+            'peak_usage': self.peak_usage,
+            'peak_controller_rss': self.peak_rss,
+            'triggered': self.triggered,
+            'aborted': self.aborted,
+        }
+
+
+class DispatchStats(object):
+    '''
+    Per-task histograms that tell a scheduler-starved run from a
+    worker-bound one:
+
+      dispatch_latency  iterator hands a host its task -> _queue_task
+      worker_idle       previous result off the final queue -> slot reused
+      queue_depth       eligible hosts still waiting for a worker, sampled
+                        at every dispatch
+      fork_cost         controller time spent starting the worker
+      in_process        controller time spent running a task in process
+                        (BENCHMARK_INLINE_ACTIONS, BENCHMARK_DRY_RUN)
+    '''
+
+    SCALES = {
+        'dispatch_latency': 1000000,
+        'worker_idle': 1000000,
+        'queue_depth': 1,
+        'fork_cost': 1000000,
+        'in_process': 1000000,
+    }
+
+    def __init__(self):
+        self.tasks = OrderedDict()
+
+    def record(self, task, name, value):
+        if task._uuid not in self.tasks:
+            self.tasks[task._uuid] = {'task_name': task.get_name()}
+        hists = self.tasks[task._uuid]
+        if name not in hists:
+            hists[name] = LogHistogram(scale=self.SCALES[name])
+        hists[name].record(value)
+
+    def to_dict(self):
+        run = dict((x, LogHistogram(scale=y)) for x, y in self.SCALES.items())
+        tasks = []
+        for task_uuid, hists in self.tasks.items():
+            task = {'task_uuid': task_uuid, 'task_name': hists['task_name']}
+            for name in self.SCALES:
+                if name in hists:
+                    run[name].merge(hists[name])
+                    task[name] = hists[name].to_dict()
+            tasks.append(task)
+        return {
+            'run': dict((x, y.to_dict()) for x, y in run.items()),
+            'tasks': tasks
+        }
+
+
+class TemplateCache(object):
+    '''
+    Renders a task's args once in the controller, for the first host, when no
+    template in them can come out differently for another host, and hands
+    every host a copy of the task with the rendered args. A template is host
+    invariant when the only variables it reads are extra vars or
+    INVARIANT_VARS, it uses no impure filter or global, and every lookup it
+    calls names a plugin on the pure_lookups allowlist. Tasks with loops are
+    never cached, since their args read the loop variable.
+
+    Decided once per task uuid; hits are the hosts that reused the render,
+    and saved_seconds charges each of them the first render's cost.
+    '''
+
+    # magic vars that are the same for every host running a task
+    INVARIANT_VARS = ('groups', 'playbook_dir', 'ansible_version', 'ansible_playbook_python', 'omit')
+    LOOKUP_FUNCTIONS = ('lookup', 'query', 'q')
+    IMPURE = ('random', 'shuffle', 'lipsum', 'now')
+
+    def __init__(self, loader, pure_lookups, extra_vars):
+        self.loader = loader
+        self.pure_lookups = tuple(pure_lookups)
+        self.invariant_vars = set(self.INVARIANT_VARS) | set(extra_vars)
+        # task uuid -> (task to dispatch, stats)
+        self.tasks = OrderedDict()
+
+    def _check(self, templar, value):
+        ''' why a template string is not host invariant, or None if it is '''
+        try:
+            ast = templar.environment.parse(value)
+        except TemplateSyntaxError as e:
+            return 'syntax error: %s' % to_text(e)
+        names = jinja2_meta.find_undeclared_variables(ast) - set(self.LOOKUP_FUNCTIONS)
+        names -= set(templar.environment.globals)
+        host_vars = names - self.invariant_vars
+        if host_vars:
+            return 'reads %s' % ', '.join(sorted(host_vars))
+        for node in ast.find_all((jinja2_nodes.Filter, jinja2_nodes.Name)):
+            if node.name in self.IMPURE:
+                return 'uses %s' % node.name
+        for node in ast.find_all(jinja2_nodes.Call):
+            if not isinstance(node.node, jinja2_nodes.Name) or node.node.name not in self.LOOKUP_FUNCTIONS:
+                continue
+            plugin = node.args[0] if node.args else None
+            if not isinstance(plugin, jinja2_nodes.Const) or plugin.value not in self.pure_lookups:
+                return 'lookup %s is not in BENCHMARK_PURE_LOOKUPS' % (
+                    plugin.value if isinstance(plugin, jinja2_nodes.Const) else '<dynamic>'
+                )
+        return None
+
+    def _templates(self, value):
+        ''' every string in a (nested) args value '''
+        if isinstance(value, dict):
+            for item in value.values():
+                for x in self._templates(item):
+                    yield x
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                for x in self._templates(item):
+                    yield x
+        elif isinstance(value, string_types):
+            yield value
+
+    def _render(self, task, task_vars):
+        stats = {'task_name': task.get_name(), 'cached': False, 'reason': None, 'hits': 0,
+                 'render_seconds': None, 'saved_seconds': 0.0}
+        if task.loop is not None or task.loop_with:
+            stats['reason'] = 'loop'
+            return task, stats
+        templar = Templar(loader=self.loader, variables=task_vars)
+        templates = [x for x in self._templates(task.args) if templar.is_template(x)]
+        if not templates:
+            stats['reason'] = 'no templates'
+            return task, stats
+        for value in templates:
+            stats['reason'] = self._check(templar, value)
+            if stats['reason'] is not None:
+                return task, stats
+        start = time.time()
+        try:
+            args = templar.template(task.args)
+        except AnsibleError as e:
+            # left for the worker to fail the task the usual way
+            stats['reason'] = 'render failed: %s' % to_text(e)
+            return task, stats
+        stats['render_seconds'] = time.time() - start
+        stats['cached'] = True
+        cached = task.copy(exclude_parent=True)
+        cached._parent = task._parent
+        # unsafe, so the worker does not template a lookup's output again
+        cached.args = wrap_var(args)
+        return cached, stats
+
+    def task_for(self, task, task_vars):
+        ''' the task to dispatch to this host '''
+        entry = self.tasks.get(task._uuid)
+        if entry is None:
+            entry = self.tasks[task._uuid] = self._render(task, task_vars)
+            return entry[0]
+        cached, stats = entry
+        if stats['cached']:
+            stats['hits'] += 1
+            stats['saved_seconds'] += stats['render_seconds']
+        return cached
+
+    def cached(self, task):
+        entry = self.tasks.get(task._uuid)
+        return entry is not None and entry[1]['cached']
+
+    def to_dict(self):
+        tasks = [dict(stats, task_uuid=task_uuid) for task_uuid, (x, stats) in self.tasks.items()]
+        return {
+            'pure_lookups': self.pure_lookups,
+            'hits': sum(x['hits'] for x in tasks),
+            'saved_seconds': sum(x['saved_seconds'] for x in tasks),
+            'tasks': tasks,
+        }
+
+
+# how the synthetic inventory was built, shared by every play in the run
+INVENTORY_STATS = {}
+
+# actions that never touch the host, for BENCHMARK_INLINE_ACTIONS=1; meta
+# tasks are already run in process by the strategies themselves
+INLINE_ACTIONS = ('debug', 'set_fact', 'assert')
+
+# what every task returns under BENCHMARK_DRY_RUN=1 unless
+# BENCHMARK_DRY_RUN_RESULT says otherwise
+DRY_RUN_RESULT = {'changed': False}
+
+# includes still run through TaskExecutor in a dry run, so the play keeps its
+# shape; they only template their arguments and never touch the host
+INCLUDE_ACTIONS = getattr(C, '_ACTION_ALL_INCLUDES', ('include', 'include_tasks', 'include_role'))
+
+# lookups run in whatever process templates them, and can block (pipe)
+LOOKUP_RE = re.compile(r'\b(lookup|query|q)\s*\(')
+
+
+class BenchmarkMixin(object):
+    '''
+    Goes ahead of a stock strategy in the bases of a benchmark_* plugin,
+    e.g. StrategyModule(BenchmarkMixin, FreeStrategyModule).
+    '''
+
+    # recorded in the meta so runs of different strategies can be told apart
+    strategy_name = None
+    hostcount = None
+    events = None
+    profiler = None
+    stack_sampler = None
+    allocations = None
+    gc_tuner = None
+    autotuner = None
+    template_cache = None
+    memory_watchdog = None
+    dispatch_stats = None
+    run_id = None
+
+    def __init__(self, tqm):
+        super(BenchmarkMixin, self).__init__(tqm)
+
+        self.hostcount = env_number('HOSTCOUNT', 100, int, minimum=0)
+        # task uuid -> name, in the order they were first dispatched
+        self._tasks_seen = OrderedDict()
+        self._task_dispatched = {}
+        self._last_dispatch = None
+        self.dispatch_stats = DispatchStats()
+        # host name -> when the iterator handed it the task it is waiting on
+        self._eligible = {}
+        # worker slot -> (receipt log, (host, task uuid)) of the last worker started there
+        self._slot_owners = {}
+        self._last_depth_event = 0
+        self._dispatched = 0
+        # the play's meta, for the memory watchdog to rewrite early
+        self._meta = None
+        # results completed in the controller instead of a worker
+        self._in_process = 0
+        self._inline_actions = None
+        # canned result every task completes with, or None to run them
+        self._dry_run = None
+        # task uuid -> whether it can run inline
+        self._inline_tasks = {}
+
+        if 'testhosts' not in self._inventory.groups:
+            display.display('adding hosts via strategy')
+            start = time.time()
+            if os.environ.get('BENCHMARK_INVENTORY', 'bulk') == 'legacy':
+                self._add_hosts_legacy()
+            else:
+                self._add_hosts_bulk()
+            INVENTORY_STATS['seconds'] = time.time() - start
+            display.display('added %s hosts in %.2fs' % (self.hostcount, INVENTORY_STATS['seconds']))
+
+    def _add_hosts_legacy(self):
+        INVENTORY_STATS['mode'] = 'legacy'
+        for x in range(0, self.hostcount):
+            host = 'host-' + str(x)
+            if host not in self._inventory.hosts:
+                hd = {
+                    'host_name': host,
+                    'groups': ['testhosts'],
+                    'host_vars': {
+                        'ansible_python_interpreter': '/usr/bin/python3'
+                    }
+                }
+                self._add_host(hd, None)
+
+    def _add_hosts_bulk(self):
+        '''
+        Build all the synthetic hosts and their group membership in one pass.
+        _add_host reconciles the whole inventory after every host, which is
+        quadratic in the host count; here that happens once at the end.
+        With BENCHMARK_GROUP_SHARDS > 1 the hosts are spread round-robin over
+        testhosts_<n> child groups of testhosts.
+        '''
+        shards = env_number('BENCHMARK_GROUP_SHARDS', 1, int, minimum=1)
+        payload_size = env_number('BENCHMARK_HOSTVAR_BYTES', 0, int, minimum=0)
+        INVENTORY_STATS.update({'mode': 'bulk', 'group_shards': shards, 'hostvar_bytes': payload_size})
+
+        # the group tree has to exist first, hosts pick up their ancestor
+        # groups when they are added
+        self._inventory.add_group('testhosts')
+        testhosts = self._inventory.groups['testhosts']
+        self._inventory.groups['all'].add_child_group(testhosts)
+        groups = ['testhosts']
+        if shards > 1:
+            groups = []
+            for x in range(0, shards):
+                name = self._inventory.add_group('testhosts_%s' % x)
+                testhosts.add_child_group(self._inventory.groups[name])
+                groups.append(name)
+
+        hosts = self._inventory.hosts
+        for x in range(0, self.hostcount):
+            name = 'host-' + str(x)
+            if name in hosts:
+                continue
+            self._inventory.add_host(name, group=groups[x % shards])
+            host = hosts[name]
+            host.set_variable('ansible_python_interpreter', '/usr/bin/python3')
+            if payload_size:
+                # distinct per host so the strings are not shared
+                host.set_variable('benchmark_payload', ((name + '.') * (payload_size // (len(name) + 1) + 1))[:payload_size])
+
+        self._inventory.reconcile_inventory()
+
+    @property
+    def br_dir(self):
+        brdir = os.environ.get('BENCHMARK_RESULTS', 'benchmark_results')
+        if not os.path.exists(brdir):
+            os.mkdir(brdir)
+        return brdir
+
+    def _write_meta(self, run_id, meta):
+        with open(os.path.join(self.br_dir, '%s_meta.json' % run_id), 'w') as f:
+            f.write(json.dumps(meta, indent=2))
+
+    def _profile_phases(self, iterator):
+        profiler = PhaseProfiler()
+        profiler.wrap(self, 'get_hosts_left', 'iterator')
+        profiler.wrap(self, '_get_next_task_lockstep', 'iterator')
+        profiler.wrap(iterator, 'get_next_task_for_host', 'iterator')
+        profiler.wrap(self._variable_manager, 'get_vars', 'vars')
+        profiler.wrap(Templar, '__init__', 'templating')
+        profiler.wrap(Templar, 'template', 'templating')
+        profiler.wrap(self, '_queue_task', 'queue')
+        profiler.wrap(self, '_process_pending_results', 'results')
+        profiler.wrap(self, '_wait_on_pending_results', 'results')
+        profiler.wrap(self._tqm, 'send_callback', 'callbacks')
+        return profiler
+
+    def _get_next_task_lockstep(self, hosts, iterator):
+        host_tasks = super(BenchmarkMixin, self)._get_next_task_lockstep(hosts, iterator)
+        ts = time.time()
+        self._eligible = {}
+        for host, task in host_tasks:
+            # hosts that are not on this task get a meta noop
+            if task and task.action not in C._ACTION_META:
+                self._eligible[host.name] = ts
+        # charge the lockstep call to the task it hands out
+        for host, task in host_tasks:
+            if task:
+                self._set_task(task)
+                break
+        return host_tasks
+
+    def _set_task(self, task):
+        ''' tells the opt-in profilers which task the controller is working on '''
+        if self.profiler is not None:
+            self.profiler.set_task(task)
+        if self.stack_sampler is not None:
+            self.stack_sampler.set_task(task)
+
+    def _track_eligible(self, iterator):
+        '''
+        Strategies without a lockstep (free, host_pinned) peek at each host's
+        next task on every pass and dispatch it once the host is no longer
+        blocked. A host that a peek finds free with a real task to run has
+        been eligible since it left its last worker, or since that peek if it
+        has not run anything yet.
+        '''
+        orig = iterator.get_next_task_for_host
+        strategy = self
+
+        @functools.wraps(orig)
+        def get_next_task_for_host(host, peek=False):
+            state, task = orig(host, peek=peek)
+            if peek and task and task.action not in C._ACTION_META:
+                blocked = strategy._blocked_hosts
+                if host.name not in strategy._eligible and not blocked.get(host.name):
+                    strategy._eligible[host.name] = blocked.released.pop(host.name, None) or time.time()
+            return state, task
+
+        iterator.get_next_task_for_host = get_next_task_for_host
+
+    def _in_flight(self):
+        ''' workers started whose result has not come off the final queue yet '''
+        in_flight = BenchmarkWorkerProcess.started + self._in_process - self._results.count - self._handler_results.count
+        return max(0, in_flight)
+
+    def _wait_for_autotune_limit(self):
+        '''
+        Blocks until a result brings the workers in flight under the limit,
+        without spinning on the controller CPU the autotuner measures. A
+        worker that dies without sending its result would keep the count up
+        for good, so the wait also ends once no worker is left alive.
+        '''
+        if self._in_flight() < self.autotuner.limit:
+            return
+        self.autotuner.throttled += 1
+        arrived = self._results.arrived
+        while not self._tqm._terminated:
+            # cleared before the check, so a result landing in between still wakes the wait
+            arrived.clear()
+            if self._in_flight() < self.autotuner.limit:
+                break
+            if not arrived.wait(0.1) and not any(x is not None and x.is_alive() for x in self._workers):
+                break
+
+    def _inline_eligible(self, task):
+        ''' whitelisted action without lookups or with_<lookup> loops, cached per task '''
+        eligible = self._inline_tasks.get(task._uuid)
+        if eligible is None:
+            ds = task._ds
+            if self.template_cache is not None and self.template_cache.cached(task) and isinstance(ds, dict):
+                # lookups in the args have already run, once
+                ds = dict((k, v) for k, v in ds.items() if k not in ('args', task.action))
+            eligible = (
+                task.action in self._inline_actions
+                and not task.loop_with
+                and not LOOKUP_RE.search(to_text(ds))
+            )
+            self._inline_tasks[task._uuid] = eligible
+        return eligible
+
+    def _complete_in_process(self, host, task, task_vars, play_context, run):
+        '''
+        Stands in for StrategyBase._queue_task without a worker. Does the same
+        bookkeeping, calls run() for the (task fields, result) a worker would
+        have sent, and puts the TaskResult on the final queue, so the results
+        thread, _process_pending_results and the callbacks handle it like any
+        worker's.
+        '''
+        self._queued_task_cache[(host.name, task._uuid)] = {
+            'host': host,
+            'task': task,
+            'task_vars': task_vars,
+            'play_context': play_context
+        }
+        self._tqm.send_callback('v2_runner_on_start', host, task)
+        start = time.time()
+        task_fields, result = run(host, task, task_vars, play_context)
+        self.dispatch_stats.record(task, 'in_process', time.time() - start)
+        if isinstance(task, Handler):
+            self._pending_handler_results += 1
+        else:
+            self._pending_results += 1
+        self._in_process += 1
+        # no worker slot will claim the receipt
+        self._receipts(task).unclaimed.add((host.name, task._uuid))
+        self._final_q.put(TaskResult(host.name, task._uuid, result, task_fields=task_fields))
+
+    def _run_inline(self, host, task, task_vars, play_context):
+        ''' what WorkerProcess._run does, minus the fork '''
+        # TaskExecutor templates the task in place; the worker gets a copy for free
+        task_copy = task.copy(exclude_parent=True)
+        task_copy._parent = task._parent
+        # the loader module has every attribute SharedPluginLoaderObj had, and
+        # later 2.9 releases deprecate the latter with a warning per call
+        try:
+            result = TaskExecutor(
+                host, task_copy, task_vars, play_context, None, self._loader, plugin_loader, self._final_q
+            ).run()
+        except AnsibleConnectionFailure:
+            result = dict(unreachable=True)
+        except Exception:
+            result = dict(failed=True, exception=to_text(traceback.format_exc()), stdout='')
+        return task_copy.dump_attrs(), result
+
+    def _structure_sizes(self):
+        '''
+        Count and estimated deep size of the controller structures that grow
+        with the inventory, from a fixed sample of each (sampled_sizeof), so
+        a snapshot taken close to the memory limit does not push the
+        controller over it. Each is estimated on its own, so shared objects
+        show up in more than one.
+        '''
+        inventory = self._inventory._inventory
+        hosts = list(inventory.hosts.values())
+        fact_cache = self._variable_manager._fact_cache
+        nonpersistent = self._variable_manager._nonpersistent_fact_cache
+        stop = (DataLoader, VariableManager, InventoryManager, HostVars, Play, Host, Group, Task, Block)
+        structures = [
+            ('hosts', len(hosts), lambda: (
+                sampled_sizeof(inventory.hosts, inventory.hosts.items(), stop=(DataLoader, Group))
+                + deep_sizeof(inventory.groups, stop=(DataLoader, Host))
+            )),
+            ('hostvars', len(hosts), lambda: sampled_sizeof(hosts, [x.vars for x in hosts])),
+            ('facts', len(fact_cache), lambda: sampled_sizeof(fact_cache, fact_cache.items(), stop=stop)),
+            ('nonpersistent_facts', len(nonpersistent),
+             lambda: sampled_sizeof(nonpersistent, nonpersistent.items(), stop=stop)),
+            ('results', len(self._results) + len(self._handler_results),
+             lambda: sampled_sizeof(self._results, list(self._results) + list(self._handler_results), stop=stop)),
+            ('queued_task_cache', len(self._queued_task_cache),
+             lambda: sampled_sizeof(self._queued_task_cache, self._queued_task_cache.items(), stop=stop)),
+            ('pending_events', len(self.events._pending),
+             lambda: sampled_sizeof(self.events._pending, self.events._pending)),
+        ]
+        sizes = OrderedDict()
+        for name, count, size in structures:
+            try:
+                sizes[name] = {'count': count, 'bytes': size()}
+            except RuntimeError:
+                # changed size under the walk
+                sizes[name] = {'count': count, 'bytes': None}
+        return sizes
+
+    def _memory_pressure(self, watchdog, rss, usage, limit):
+        '''
+        Called from the watchdog thread once memory crosses its threshold:
+        gets the event log, histograms and meta onto disk, and writes
+        <run>_memory.json with the allocation sites and structures holding
+        the memory.
+        '''
+        start = time.time()
+        self.events.flush()
+        self._write_histograms()
+        self._meta['memory'] = watchdog.to_dict()
+        self._meta['dispatched'] = self._dispatched
+        self._write_meta(self.run_id, self._meta)
+
+        top = None
+        if tracemalloc is not None and tracemalloc.is_tracing():
+            top = [
+                ['%s:%s' % (x.traceback[0].filename, x.traceback[0].lineno), x.size, x.count]
+                for x in tracemalloc.take_snapshot().statistics('lineno')[:watchdog.top]
+            ]
+        snapshot = OrderedDict([
+            ('ts', start),
+            ('source', watchdog.source),
+            ('usage', usage),
+            ('limit', limit),
+            ('controller_rss', rss),
+            ('task', self._tasks_seen.get(next(reversed(self._tasks_seen), None))),
+            ('dispatched', self._dispatched),
+            ('in_flight', self._in_flight()),
+            ('tracemalloc_top', top),
+            ('structures', self._structure_sizes()),
+        ])
+        snapshot['seconds'] = time.time() - start
+        with open(os.path.join(self.br_dir, '%s_memory.json' % self.run_id), 'w') as f:
+            f.write(json.dumps(snapshot, indent=2))
+
+    def _write_histograms(self):
+        for attempt in range(3):
+            try:
+                histograms = self.dispatch_stats.to_dict()
+                break
+            except RuntimeError:
+                # the watchdog thread raced a dispatch adding a bucket
+                continue
+        else:
+            return
+        with open(os.path.join(self.br_dir, '%s_histograms.json' % self.run_id), 'w') as f:
+            f.write(json.dumps(histograms, indent=2))
+
+    def _run_dry(self, host, task, task_vars, play_context):
+        '''
+        The canned result, without touching the host. The args are still
+        templated with the host's vars, as TaskExecutor would, unless they
+        call a lookup: that runs on the remote side of a real run, and here
+        would run once per host in the controller.
+        '''
+        if task.action in INCLUDE_ACTIONS:
+            return self._run_inline(host, task, task_vars, play_context)
+        if not LOOKUP_RE.search(to_text(task.args)):
+            try:
+                Templar(loader=self._loader, variables=task_vars).template(task.args)
+            except AnsibleError as e:
+                return task.dump_attrs(), dict(failed=True, msg=to_text(e))
+        result = dict(self._dry_run)
+        if task.notify is not None:
+            # TaskExecutor.run sets this for every task, handlers only fire on changed
+            result['_ansible_notify'] = task.notify
+        return task.dump_attrs(), result
+
+    def _queue_task(self, host, task, task_vars, play_context):
+        # lets the noop connection key its seeded draws on the task, and the
+        # connection telemetry tie its records to it
+        task_vars['benchmark_task_name'] = task.get_name()
+        task_vars['benchmark_task_uuid'] = task._uuid
+        original = task
+        if self.template_cache is not None:
+            task = self.template_cache.task_for(task, task_vars)
+        inline = self._dry_run is not None or (
+            self._inline_actions is not None and self._inline_eligible(original)
+        )
+        if self.autotuner is not None and not inline:
+            self._wait_for_autotune_limit()
+        ts = time.time()
+        self._set_task(task)
+        if task._uuid not in self._tasks_seen:
+            if self.allocations is not None:
+                self.allocations.boundary(task)
+            if self.gc_tuner is not None:
+                self.gc_tuner.boundary()
+            self._tasks_seen[task._uuid] = task.get_name()
+            self.events.emit('task', ts, task._uuid, task.name)
+        self.events.emit('queue', ts, host.name, task._uuid)
+        self._dispatched += 1
+        self._task_dispatched[task._uuid] = self._task_dispatched.get(task._uuid, 0) + 1
+        self._last_dispatch = ts
+        self._blocked_hosts.enter(host.name, task._uuid)
+
+        eligible = self._eligible.pop(host.name, None)
+        if eligible is not None:
+            self.dispatch_stats.record(task, 'dispatch_latency', ts - eligible)
+        depth = len(self._eligible)
+        self.dispatch_stats.record(task, 'queue_depth', depth)
+        if ts - self._last_depth_event >= 0.1:
+            self._last_depth_event = ts
+            self.events.emit('depth', ts, task._uuid, depth, len(self._blocked_hosts.occupants))
+
+        if self._dry_run is not None:
+            return self._complete_in_process(host, task, task_vars, play_context, self._run_dry)
+        if inline:
+            return self._complete_in_process(host, task, task_vars, play_context, self._run_inline)
+        result = super(BenchmarkMixin, self)._queue_task(host, task, task_vars, play_context)
+        self._record_worker_start(host, task)
+        return result
+
+    def _record_worker_start(self, host, task):
+        # _cur_worker has moved one past the slot that was just used
+        slot = (self._cur_worker - 1) % len(self._workers)
+        worker = self._workers[slot]
+        if getattr(worker, '_task', None) is not task or getattr(worker, '_host', None) is not host:
+            for slot, worker in enumerate(self._workers):
+                if getattr(worker, '_task', None) is task and getattr(worker, '_host', None) is host:
+                    break
+            else:
+                return
+        if worker.fork_cost is not None:
+            self.dispatch_stats.record(task, 'fork_cost', worker.fork_cost)
+        previous = self._slot_owners.get(slot)
+        self._slot_owners[slot] = (self._receipts(task), (host.name, task._uuid))
+        if previous is None:
+            return
+        receipts, key = previous
+        self._results_lock.acquire()
+        try:
+            freed = receipts.claim(key)
+        finally:
+            self._results_lock.release()
+        if worker.fork_time is None:
+            return
+        # the slot can be reused before the results thread has read the
+        # previous result, which counts as no idle time
+        idle = 0.0 if freed is None else max(0.0, worker.fork_time - freed)
+        self.dispatch_stats.record(task, 'worker_idle', idle)
+
+    def _receipts(self, task):
+        ''' the receipt log the results thread files this task's results in '''
+        return self._handler_results if isinstance(task, Handler) else self._results
+
+    def _read_settings(self):
+        '''
+        Every BENCHMARK_* knob run() acts on, parsed and checked up front so a
+        bad value fails the play before any thread, pinning or patch is in place.
+        '''
+        settings = {}
+        controller_cpus = os.environ.get('BENCHMARK_CONTROLLER_CPU')
+        worker_cpus = os.environ.get('BENCHMARK_WORKER_CPUS')
+        settings['controller_cpus'] = parse_cpus(controller_cpus) if controller_cpus else None
+        settings['worker_cpus'] = parse_cpus(worker_cpus) if worker_cpus else None
+        settings['ps_interval'] = env_number('BENCHMARK_PS_INTERVAL', 0.1)
+        settings['ps_pss'] = os.environ.get('BENCHMARK_PS_PSS', '0') == '1'
+        settings['metrics_port'] = env_number('BENCHMARK_METRICS_PORT', 0, int)
+        settings['metrics_socket'] = os.environ.get('BENCHMARK_METRICS_SOCKET')
+        settings['profile_phases'] = os.environ.get('BENCHMARK_PROFILE_PHASES', '0') == '1'
+
+        gc_freeze = os.environ.get('BENCHMARK_GC_FREEZE', '0')
+        gc_freeze = {'0': None, '1': 'play'}.get(gc_freeze, gc_freeze)
+        if gc_freeze not in (None, 'play', 'task'):
+            raise AnsibleError('BENCHMARK_GC_FREEZE must be 0, 1, play or task, not %r' % gc_freeze)
+        if gc_freeze and not hasattr(gc, 'freeze'):
+            display.warning('BENCHMARK_GC_FREEZE needs python 3.7, not freezing')
+            gc_freeze = None
+        settings['gc_freeze'] = gc_freeze
+        gc_threshold = os.environ.get('BENCHMARK_GC_THRESHOLD')
+        if gc_threshold:
+            try:
+                gc_threshold = [int(x) for x in gc_threshold.split(',')]
+            except ValueError:
+                raise AnsibleError('BENCHMARK_GC_THRESHOLD must be up to three comma separated integers, not %r' % gc_threshold)
+        settings['gc_threshold'] = gc_threshold or None
+
+        settings['trace_frames'] = env_number('BENCHMARK_TRACEMALLOC', 0, int)
+        settings['trace_top'] = env_number('BENCHMARK_TRACEMALLOC_TOP', 20, int)
+
+        inline_actions = os.environ.get('BENCHMARK_INLINE_ACTIONS', '0')
+        settings['inline_actions'] = None
+        if inline_actions not in ('', '0'):
+            settings['inline_actions'] = INLINE_ACTIONS if inline_actions == '1' else tuple(inline_actions.split(','))
+
+        settings['dry_run'] = None
+        if os.environ.get('BENCHMARK_DRY_RUN', '0') == '1':
+            settings['dry_run'] = DRY_RUN_RESULT
+            dry_run_result = os.environ.get('BENCHMARK_DRY_RUN_RESULT')
+            if dry_run_result:
+                try:
+                    settings['dry_run'] = json.loads(dry_run_result)
+                except ValueError as e:
+                    raise AnsibleError('BENCHMARK_DRY_RUN_RESULT is not valid JSON: %s' % to_text(e))
+                if not isinstance(settings['dry_run'], dict):
+                    raise AnsibleError('BENCHMARK_DRY_RUN_RESULT must be a JSON object')
+
+        settings['template_cache'] = os.environ.get('BENCHMARK_TEMPLATE_CACHE', '0') == '1'
+        settings['pure_lookups'] = [x for x in os.environ.get('BENCHMARK_PURE_LOOKUPS', '').split(',') if x]
+
+        settings['autotune'] = None
+        if os.environ.get('BENCHMARK_AUTOTUNE', '0') == '1':
+            settings['autotune'] = dict(
+                start=env_number('BENCHMARK_AUTOTUNE_START', 0, int) or None,
+                step=env_number('BENCHMARK_AUTOTUNE_STEP', 0, int) or None,
+                interval=env_number('BENCHMARK_AUTOTUNE_INTERVAL', 2.0),
+                cpu_limit=env_number('BENCHMARK_AUTOTUNE_CPU', 0.9),
+            )
+
+        settings['memory_watchdog'] = None
+        if os.environ.get('BENCHMARK_MEMORY_WATCHDOG', '0') == '1':
+            settings['memory_watchdog'] = dict(
+                threshold=env_number('BENCHMARK_MEMORY_THRESHOLD', 0.9),
+                interval=env_number('BENCHMARK_MEMORY_INTERVAL', 1.0),
+                abort=os.environ.get('BENCHMARK_MEMORY_ABORT', '0') == '1',
+                top=settings['trace_top'],
+            )
+
+        settings['stack_hz'] = env_number('BENCHMARK_STACK_SAMPLE_HZ', 0.0)
+        settings['stack_clock'] = os.environ.get('BENCHMARK_STACK_SAMPLE_CLOCK', 'cpu')
+        if settings['stack_hz'] > 0 and settings['stack_clock'] not in StackSampler.CLOCKS:
+            raise AnsibleError('BENCHMARK_STACK_SAMPLE_CLOCK must be one of %s, not %r' % (
+                ', '.join(sorted(StackSampler.CLOCKS)), settings['stack_clock']))
+        return settings
+
+    def run(self, iterator, play_context):
+        display.display('[strategy] run')
+
+        settings = self._read_settings()
+        placement = CpuPlacement(controller=settings['controller_cpus'], workers=settings['worker_cpus'])
+
+        # bound before anything is started or patched, so a port in use fails the play with nothing to undo
+        metrics = metrics_server(port=settings['metrics_port'], path=settings['metrics_socket'])
+
+        start_time = time.time()
+        run_id = self.run_id = str(start_time)
+        ps_interval = settings['ps_interval']
+        meta = {
+            'start': start_time,
+            'stop': None,
+            'strategy': self.strategy_name,
+            'forks': self._variable_manager.get_vars().get('ansible_forks', None),
+            'hosts': self.hostcount,
+            'ps_interval': ps_interval,
+            'inventory': INVENTORY_STATS,
+            'time': None
+        }
+        lockstep = getattr(super(BenchmarkMixin, self), '_get_next_task_lockstep', None) is not None
+        sampler = None
+        pinned = False
+
+        # everything started from here on is undone in the finally, however far the setup got
+        try:
+            # before the benchmark threads start, so they inherit the pinning
+            placement.start()
+            pinned = True
+
+            if ps_interval > 0:
+                sampler = ProcessTreeSampler(
+                    os.path.join(self.br_dir, '%s_ps.ndjson' % run_id),
+                    interval=ps_interval,
+                    pss=settings['ps_pss']
+                )
+                sampler.start()
+
+            self._write_meta(run_id, meta)
+            self._meta = meta
+            # workers inherit it, for the connection plugins' telemetry
+            os.environ['BENCHMARK_RUN_ID'] = run_id
+
+            self.events = EventWriter(os.path.join(self.br_dir, '%s_events.ndjson' % run_id))
+            self.events.start()
+            self._blocked_hosts = OccupancyTracker(self.events, self._blocked_hosts)
+            self._results_lock.acquire()
+            try:
+                arrived = threading.Event()
+                self._results = ResultReceiptLog(self.events, arrived, self._results)
+                self._handler_results = ResultReceiptLog(self.events, arrived, self._handler_results)
+            finally:
+                self._results_lock.release()
+
+            # StrategyBase._queue_task looks WorkerProcess up in its own module
+            workers_path = os.path.join(self.br_dir, '%s_workers.ndjson' % run_id)
+            with open(workers_path, 'w') as f:
+                f.write(json.dumps({'fields': BenchmarkWorkerProcess.FIELDS}) + '\n')
+            BenchmarkWorkerProcess.record_path = workers_path
+            BenchmarkWorkerProcess.started = 0
+            BenchmarkWorkerProcess.placement = placement if placement.workers else None
+            strategy_base.WorkerProcess = BenchmarkWorkerProcess
+
+            if metrics is not None:
+                metrics.serve(self)
+
+            if not lockstep:
+                self._track_eligible(iterator)
+
+            if settings['profile_phases']:
+                self.profiler = self._profile_phases(iterator)
+
+            if settings['gc_freeze'] or settings['gc_threshold']:
+                self.gc_tuner = GcTuner(freeze=settings['gc_freeze'], threshold=settings['gc_threshold'])
+                self.gc_tuner.start()
+
+            if settings['trace_frames'] > 0:
+                if tracemalloc is None:
+                    display.warning('BENCHMARK_TRACEMALLOC needs python 3, not tracing allocations')
+                else:
+                    self.allocations = AllocationTracker(
+                        os.path.join(self.br_dir, '%s_tracemalloc.ndjson' % run_id),
+                        frames=settings['trace_frames'],
+                        top=settings['trace_top']
+                    )
+                    self.allocations.start()
+
+            self._inline_actions = settings['inline_actions']
+
+            if settings['dry_run'] is not None:
+                self._dry_run = settings['dry_run']
+                meta['dry_run'] = self._dry_run
+
+            if settings['template_cache']:
+                self.template_cache = TemplateCache(
+                    self._loader,
+                    pure_lookups=settings['pure_lookups'],
+                    extra_vars=self._variable_manager.extra_vars
+                )
+
+            if settings['autotune'] is not None:
+                self.autotuner = ForkAutotuner(self, ceiling=len(self._workers), **settings['autotune'])
+                self.autotuner.start()
+
+            if settings['memory_watchdog'] is not None:
+                self.memory_watchdog = MemoryWatchdog(self, **settings['memory_watchdog'])
+                self.memory_watchdog.start()
+
+            if settings['stack_hz'] > 0:
+                self.stack_sampler = StackSampler(settings['stack_hz'], settings['stack_clock'])
+                self.stack_sampler.start()
+
+            result = super(BenchmarkMixin, self).run(iterator, play_context)
+        finally:
+            meta['stop'] = time.time()
+            if self.stack_sampler is not None:
+                self.stack_sampler.stop()
+                self.stack_sampler.write(os.path.join(self.br_dir, '%s_stacks' % run_id))
+                meta['stack_samples'] = self.stack_sampler.samples
+            if self.allocations is not None:
+                self.allocations.stop()
+                meta['tracemalloc_snapshots'] = self.allocations.snapshots
+            if self.gc_tuner is not None:
+                meta['gc'] = self.gc_tuner.stop()
+            BenchmarkWorkerProcess.placement = None
+            if pinned:
+                meta['affinity'] = placement.stop()
+            if self.autotuner is not None:
+                self.autotuner.stop()
+                meta['autotune'] = self.autotuner.to_dict()
+            if self.memory_watchdog is not None:
+                self.memory_watchdog.stop()
+                meta['memory'] = self.memory_watchdog.to_dict()
+            strategy_base.WorkerProcess = WorkerProcess
+            self._write_histograms()
+            if self.template_cache is not None:
+                template_cache = self.template_cache.to_dict()
+                with open(os.path.join(self.br_dir, '%s_template_cache.json' % run_id), 'w') as f:
+                    f.write(json.dumps(template_cache, indent=2))
+                meta['template_cache'] = {
+                    'hits': template_cache['hits'],
+                    'saved_seconds': template_cache['saved_seconds'],
+                }
+            if self.profiler is not None:
+                self.profiler.restore()
+                phases = self.profiler.to_dict(meta['stop'] - start_time)
+                phases['hosts'] = self.hostcount
+                phases['forks'] = meta['forks']
+                phases['strategy'] = self.strategy_name
+                with open(os.path.join(self.br_dir, '%s_phases.json' % run_id), 'w') as f:
+                    f.write(json.dumps(phases, indent=2))
+            # the wrapper is an instance attribute over the class method
+            if 'get_next_task_for_host' in vars(iterator):
+                del iterator.get_next_task_for_host
+            os.environ.pop('BENCHMARK_RUN_ID', None)
+
+            if sampler is not None:
+                sampler.stop()
+            if self.events is not None:
+                self.events.close()
+                meta['events'] = self.events.records
+
+            display.display('[strategy] writing benchmark results to %s' % self.br_dir)
+            meta['time'] = str(time.time())
+            meta['dispatched'] = self._dispatched
+            meta['in_process'] = self._in_process
+            meta['inline_actions'] = self._inline_actions
+            self._write_meta(run_id, meta)
+
+        return result